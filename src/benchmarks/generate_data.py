@@ -0,0 +1,96 @@
+"""
+Generates a synthetic csv with the same schema, encoding and formats of the ANS 'dados gerais das reclamações' csv,
+with similar cardinalities: a few thousand operators, where the biggest ones receive most of the complaints, two
+classifications, a few natures and a couple hundred subtemas.
+    python benchmarks/generate_data.py 1m demandas_1m.csv
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+HEADER = ["REGISTRO_ANS", "RAZAO_SOCIAL", "QTD_BENEFICIARIOS", "ID_DEMANDA", "DATA_ATENDIMENTO",
+          "CLASSIFICACAO", "NATUREZA_DEMANDA", "SUBTEMA_DEMANDA", "COMPETENCIA", "DATA_ATUALIZACAO"]
+
+OPERATORS = 3000
+CLASSIFICACOES = ["Assistencial", "Não Assistencial"]
+NATUREZAS = ["Reclamação", "Informação", "Consulta", "Denúncia", "Sugestão"]
+SUBTEMAS = 250
+CHUNK_SIZE = 500_000
+START_DATE = np.datetime64("2015-01-01T00:00:00")
+DAYS = 8 * 365
+
+
+def create_operators(rng):
+    """ Returns the ans register, name and beneficiaries of each operator. """
+    ans = rng.choice(np.arange(300_000, 500_000), size=OPERATORS, replace=False)
+    kinds = np.array(["SAÚDE", "ODONTOLÓGICA", "MÉDICA", "ASSISTÊNCIA"])
+    names = np.array([f"OPERADORA {kinds[i % len(kinds)]} {i:04d} S.A." for i in range(OPERATORS)], dtype=object)
+    beneficiaries = rng.lognormal(mean=9, sigma=2, size=OPERATORS).astype(np.int64)
+    return ans, names, beneficiaries
+
+
+def zipf_choice(rng, count, size, exponent=1.1):
+    """ Picks 'size' indexes in [0, count) where the first indexes are much more frequent, like real operators. """
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return rng.choice(count, size=size, p=weights / weights.sum())
+
+
+def generate_chunk(rng, operators, first_id, size):
+    ans, names, beneficiaries = operators
+    operator = zipf_choice(rng, OPERATORS, size)
+    dates = START_DATE + rng.integers(0, DAYS * 86400, size=size).astype("timedelta64[s]")
+    date_strings = pd.Series(dates).dt.strftime("%d/%m/%Y %H:%M:%S")
+    # some dates don't have the time, like in the real csv.
+    without_time = rng.random(size) < 0.1
+    date_strings = date_strings.where(~without_time, date_strings.str[:10])
+    competencia = pd.Series(dates).dt.strftime("%Y%m")
+
+    subtemas = np.array([f"Subtema {i:03d} - Cobertura assistencial" for i in range(SUBTEMAS)], dtype=object)
+    return pd.DataFrame({
+        "REGISTRO_ANS": ans[operator],
+        "RAZAO_SOCIAL": names[operator],
+        "QTD_BENEFICIARIOS": beneficiaries[operator],
+        "ID_DEMANDA": np.arange(first_id, first_id + size),
+        "DATA_ATENDIMENTO": date_strings,
+        "CLASSIFICACAO": np.array(CLASSIFICACOES, dtype=object)[rng.choice(2, size=size, p=[0.8, 0.2])],
+        "NATUREZA_DEMANDA": np.array(NATUREZAS, dtype=object)[zipf_choice(rng, len(NATUREZAS), size)],
+        "SUBTEMA_DEMANDA": subtemas[zipf_choice(rng, SUBTEMAS, size, exponent=0.8)],
+        "COMPETENCIA": competencia,
+        "DATA_ATUALIZACAO": "01/01/2023",
+    })
+
+
+def generate_csv(file_path, rows, seed=0):
+    """ Writes a csv with 'rows' synthetic demandas, in chunks so memory doesn't grow with the number of rows. """
+    rng = np.random.default_rng(seed)
+    operators = create_operators(rng)
+    with open(file_path, "w", encoding="ISO-8859-1", newline="") as csv_file:
+        csv_file.write(";".join(HEADER) + "\n")
+        # the loader reads the csv with header=1, which also skips the first row after the header.
+        total_rows = rows + 1
+        written = 0
+        while written < total_rows:
+            size = min(CHUNK_SIZE, total_rows - written)
+            chunk = generate_chunk(rng, operators, written + 1, size)
+            chunk.to_csv(csv_file, sep=";", header=False, index=False)
+            written += size
+    return file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic demandas csv.")
+    parser.add_argument("size", help=f"number of rows or one of {tuple(SIZES)}.")
+    parser.add_argument("output", help="csv file to write.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = SIZES[args.size] if args.size in SIZES else int(args.size)
+    generate_csv(os.path.abspath(args.output), rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Load test comparing the wsgi (flask) and asgi (flask_api/asgi.py) serving modes over the database in settings, or the
+one given with '--database'. Both servers are started by this script, each level of concurrency sends 'requests' GET
+requests to every route and the results are written as json:
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 500 --output load_test.json
+
+The routes are templates, every request fills '{after}' with a random demanda_id and '{ans}' and '{other_ans}' with
+random ans of the database, so the requests reach sqlite instead of the count cache (the pairs of ans rarely repeat).
+The cache hits are reported with the results.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(SRC_DIR)
+
+from settings import DATABASE_PATH  # noqa: E402
+
+SERVERS = {
+    "wsgi": [sys.executable, "-m", "flask", "--app", "flask_api.app", "run", "--with-threads", "--port", "{port}"],
+    "asgi": [sys.executable, "-m", "uvicorn", "flask_api.asgi:app", "--log-level", "warning", "--port", "{port}"],
+}
+DEFAULT_ROUTES = ["/demandas?limit=100&after={after}",
+                  "/demandas/count?group_by=natureza_demanda&ans={ans},{other_ans}"]
+
+
+def database_file(database_url):
+    return database_url.replace("sqlite:///", "", 1)
+
+
+def sample_values(database_url):
+    """ Values the route templates are filled with: the range of the demanda ids and the distinct ans. """
+    with sqlite3.connect(database_file(database_url)) as connection:
+        first_id, last_id = connection.execute("SELECT min(demanda_id), max(demanda_id) FROM Demandas").fetchone()
+        ans = [row[0] for row in connection.execute("SELECT DISTINCT ans FROM Demandas")]
+    return {"ids": (first_id, last_id), "ans": ans}
+
+
+def fill_route(route, values, rng):
+    return route.format(after=rng.randint(*values["ids"]), ans=rng.choice(values["ans"]),
+                        other_ans=rng.choice(values["ans"]))
+
+
+def start_server(mode, port, database_url):
+    command = [part.format(port=port) for part in SERVERS[mode]]
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, DATABASE_PATH=database_url)
+    server = subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/demandas/count/cache")
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{mode} server didn't start")
+
+
+def run_client(port, paths):
+    """
+    Send a request to each of 'paths' in a keep alive connection, returns the latency of each one in seconds and the
+    number of count cache hits.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = []
+    cache_hits = 0
+    for path in paths:
+        start = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}")
+        cache_hits += response.getheader("X-Cache") == "HIT"
+    connection.close()
+    return latencies, cache_hits
+
+
+def measure(port, route, values, rng, concurrency, requests):
+    """ Returns the throughput and latency percentiles of 'requests' requests split between 'concurrency' clients. """
+    per_client = max(requests // concurrency, 1)
+    paths = [[fill_route(route, values, rng) for _ in range(per_client)] for _ in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run_client, [port] * concurrency, paths))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {"requests": len(latencies), "throughput": len(latencies) / elapsed,
+            "p50_ms": quantiles[49] * 1000, "p99_ms": quantiles[98] * 1000,
+            "cache_hits": sum(cache_hits for _, cache_hits in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the wsgi and asgi serving modes.")
+    parser.add_argument("--modes", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument("--routes", nargs="+", default=DEFAULT_ROUTES)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=500, help="requests per route and concurrency level.")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random values of the routes.")
+    parser.add_argument("--database", default=DATABASE_PATH, help="sqlalchemy url of the sqlite database served.")
+    parser.add_argument("--output", help="json file to write the results, printed if not given.")
+    args = parser.parse_args()
+
+    values = sample_values(args.database)
+    results = []
+    for mode in args.modes:
+        server = start_server(mode, args.port, args.database)
+        # both modes get the same requests.
+        rng = random.Random(args.seed)
+        try:
+            for route in args.routes:
+                for concurrency in args.concurrency:
+                    result = measure(args.port, route, values, rng, concurrency, args.requests)
+                    results.append({"mode": mode, "route": route, "concurrency": concurrency, **result})
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Benchmark suite. Generates a synthetic dataset (see generate_data.py), loads it with the data loader and measures the
+routes of the flask app over it, writing the results as json so they can be compared between commits:
+    python benchmarks/run.py --size 1m --output results_1m.json --baseline previous_results_1m.json
+
+For every route it reports p50/p99 latency, throughput and the peak of python memory allocated by one request.
+The count routes clear the count cache before each request, unless the route name ends with '(cached)'.
+With '--column-store' the count routes are measured again using the column store, reporting its load time, memory
+and the speedup over sqlite.
+With '--snapshot' the database is also published as a read only snapshot, and the startup time of a new worker (the
+import of the app) and the latency of its first request are measured in new processes, serving the database and the
+snapshot, with the database file evicted from the os page cache before each process (cold) and already cached (warm).
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.append(SRC_DIR)
+
+from benchmarks.generate_data import SIZES, generate_csv  # noqa: E402
+
+# the benchmark measures the slow queries too, instead of interrupting them.
+os.environ.setdefault("QUERY_TIMEOUT_MS", "0")
+
+ROUTES = [
+    ("page", "/demandas?limit=100"),
+    ("page after cursor", "/demandas?limit=100&after={middle_id}"),
+    ("filter operator", "/demandas?razao_social={operator}&limit=1000"),
+    ("filter ans narrow fields", "/demandas?fields=demanda_id,ans,data_atendimento_demanda&ans={ans}&limit=1000"),
+    ("count", "/demandas/count"),
+    ("count by operator", "/demandas/count?group_by=razao_social"),
+    ("count by operator (cached)", "/demandas/count?group_by=razao_social"),
+    ("count by classification of operator", "/demandas/count?group_by=classificacao_demanda&razao_social={operator}"),
+    ("count by ans and nature", "/demandas/count?group_by=ans,natureza_demanda"),
+    ("count by subject of ans", "/demandas/count?group_by=subtema_demanda&ans={ans}"),
+    ("timeseries month", "/demandas/count/timeseries?bucket=month&from=2021-01-01&to=2021-12-31"),
+    ("timeseries operator month", "/demandas/count/timeseries?bucket=month&from=2021-01-01&to=2021-12-31"
+                                  "&razao_social={operator}"),
+    ("search", "/demandas/search?q=saude%20cobertura&limit=100"),
+    ("export operator ndjson", "/demandas/export?format=ndjson&razao_social={operator}"),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_database(csv_path, database_path, loader_args):
+    """ Runs the data loader in a child process, returns its elapsed time and peak memory. """
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    command = [sys.executable, os.path.join(SRC_DIR, "db_utility", "data_loader.py"), "--file", csv_path,
+               "--database", f"sqlite:///{database_path}", *loader_args]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=SRC_DIR, env=dict(os.environ, PYTHONPATH=SRC_DIR), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    # the loader is the only child process, so the children peak is its peak (in KB on linux).
+    return {"seconds": elapsed, "peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def use_database(database_path, profile_name):
+    """ Point the flask app to the benchmark database, returns the test client. """
+    from sqlalchemy.orm import scoped_session, sessionmaker
+    from flask_api.app import app
+    from flask_api.db import database
+    from settings import DATABASE_PROFILES
+
+    profile = DATABASE_PROFILES[profile_name]
+    database_url = f"sqlite:///{database_path}"
+    database.engine = database.create_profile_engine(database_url, profile)
+    database.session = scoped_session(sessionmaker(autoflush=False, bind=database.engine))
+    database.read_engine = database.engine
+    database.read_session = database.session
+    if profile["read_only_pool"]:
+        database.read_engine = database.create_profile_engine(database_url, profile, read_only=True)
+        database.read_session = scoped_session(sessionmaker(autoflush=False, bind=database.read_engine))
+    return app.test_client()
+
+
+def sample_values(database_path):
+    """ Values used in the route templates: an operator and an ans with a median number of demandas and the middle id. """
+    import sqlite3
+    with sqlite3.connect(database_path) as connection:
+        rows, middle_id = connection.execute("SELECT count(*), (min(demanda_id) + max(demanda_id)) / 2 "
+                                             "FROM Demandas").fetchone()
+        ans = connection.execute("SELECT ans FROM Demandas GROUP BY ans ORDER BY count(*)").fetchall()
+        operators = connection.execute("SELECT value FROM Demandas JOIN Demandas_razao_social ON code = razao_social "
+                                       "GROUP BY razao_social ORDER BY count(*)").fetchall()
+    return rows, {"middle_id": middle_id, "operator": quote(operators[len(operators) // 2][0]),
+                  "ans": ans[len(ans) // 2][0]}
+
+
+def clear_count_cache():
+    from flask_api.cache import count_cache
+    from flask_api.db.column_store import column_store
+
+    count_cache.clear()
+    if column_store.snapshot is not None:
+        # the data didn't change, so the column store snapshot is still valid after clearing the cache.
+        column_store.snapshot.generation = count_cache.generation
+
+
+def measure_route(client, path, requests, clear_cache):
+    def get():
+        if clear_cache:
+            clear_count_cache()
+        response = client.get(path)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+
+    get()  # warm up
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        get()
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    get()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {"p50_ms": quantiles[49] * 1000, "p99_ms": quantiles[98] * 1000,
+            "throughput": requests / elapsed, "peak_memory_kb": peak_memory / 1024}
+
+
+def measure_column_store(client, routes, requests):
+    """ Loads the column store and measures the count routes again with it, next to their sqlite results. """
+    import flask_api.db.database as db
+    from flask_api.db.column_store import column_store
+
+    start = time.perf_counter()
+    with db.read_engine.connect() as connection:
+        snapshot = column_store.load(connection)
+    load = {"seconds": time.perf_counter() - start, "memory_mb": snapshot.nbytes() / 1024 / 1024}
+
+    column_store.enabled = True
+    results = []
+    for route in routes:
+        if route["path"].startswith("/demandas/count?") or route["path"] == "/demandas/count":
+            result = measure_route(client, route["path"], requests, clear_cache=not route["name"].endswith("(cached)"))
+            results.append({"name": f"{route['name']} (column store)", "path": route["path"], **result,
+                            "speedup": route["p50_ms"] / result["p50_ms"]})
+    column_store.enabled = False
+    return load, results
+
+
+# Run in a new process: imports the app, makes its first request and prints the timings.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from flask_api.app import app
+started = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+response.get_data()
+finished = time.perf_counter()
+print(json.dumps({"startup_ms": (started - start) * 1000, "first_request_ms": (finished - started) * 1000,
+                  "status": response.status_code}))
+"""
+
+# Path of the first request of a new worker.
+FIRST_REQUEST_PATH = "/demandas/count?group_by=razao_social"
+
+
+def evict_from_page_cache(paths):
+    """
+    Drops the cached pages of the files in 'paths' (only clean pages can be dropped, so they are synced first), the
+    next reads come from the disk. Returns False where posix_fadvise isn't available, like on macos.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for path in paths:
+        file_descriptor = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(file_descriptor)
+            os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(file_descriptor)
+    return True
+
+
+def measure_startup(environment, database_files, runs=5):
+    """
+    Median startup time and first request latency of 'runs' new processes with the 'environment' variables, with the
+    'database_files' evicted from the page cache before each process (cold) and already cached (warm). The cold
+    results are None where the files can't be evicted.
+    """
+    env = {name: value for name, value in os.environ.items() if name not in ("DATABASE_PATH", "SNAPSHOT_PATH")}
+    env.update(environment, PYTHONPATH=SRC_DIR)
+    measurements = {}
+    for cache in ("cold", "warm"):
+        results = []
+        for _ in range(runs):
+            if cache == "cold" and not evict_from_page_cache(database_files):
+                break
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, FIRST_REQUEST_PATH], cwd=SRC_DIR, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            if result["status"] != 200:
+                raise RuntimeError(f"{FIRST_REQUEST_PATH} returned {result['status']}")
+            results.append(result)
+        measurements[cache] = {key: statistics.median(result[key] for result in results)
+                               for key in ("startup_ms", "first_request_ms")} if results else None
+    return measurements
+
+
+def measure_snapshot(database_path, profile_name):
+    """ Publishes the database as a snapshot, measures the startup of workers serving the database and the snapshot. """
+    from sqlalchemy import create_engine
+    from flask_api.db.snapshot import publish_snapshot
+
+    snapshot_path = f"{os.path.splitext(database_path)[0]}_snapshot.sqlite"
+    database_url = f"sqlite:///{database_path}"
+    engine = create_engine(database_url)
+    start = time.perf_counter()
+    publish_snapshot(engine, snapshot_path)
+    publish_seconds = time.perf_counter() - start
+    engine.dispose()
+
+    return {
+        "publish_seconds": publish_seconds,
+        "snapshot_mb": os.path.getsize(snapshot_path) / 1024 / 1024,
+        "first_request_path": FIRST_REQUEST_PATH,
+        "database": measure_startup({"DATABASE_PATH": database_url, "DATABASE_PROFILE": profile_name},
+                                    [path for path in (database_path, f"{database_path}-wal") if os.path.exists(path)]),
+        "snapshot": measure_startup({"SNAPSHOT_PATH": snapshot_path, "DATABASE_PROFILE": profile_name},
+                                    [snapshot_path]),
+    }
+
+
+def compare(results, baseline_path):
+    """ Prints the change of the p50 latency of every route compared to a previous result file. """
+    with open(baseline_path) as baseline_file:
+        baseline = {route["name"]: route for route in json.load(baseline_file)["routes"]}
+    print(f"{'route':45} {'baseline p50':>12} {'p50':>10} {'change':>8}")
+    for route in results["routes"]:
+        if route["name"] in baseline:
+            old = baseline[route["name"]]["p50_ms"]
+            print(f"{route['name']:45} {old:12.2f} {route['p50_ms']:10.2f} {route['p50_ms'] / old - 1:+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data loader and the routes over synthetic data.")
+    parser.add_argument("--size", default="10k", help=f"rows of the dataset, a number or one of {tuple(SIZES)}.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "demandas_benchmark"),
+                        help="where the csv and database are kept, the csv is reused between runs.")
+    parser.add_argument("--requests", type=int, default=50, help="measured requests per route.")
+    parser.add_argument("--profile", default="default", help="database profile of settings.DATABASE_PROFILES.")
+    parser.add_argument("--loader-args", default="", help="extra arguments to the data loader, e.g. '--workers 4'.")
+    parser.add_argument("--column-store", action="store_true", help="also measure the counts with the column store.")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="also measure the startup and first request of workers serving a read only snapshot.")
+    parser.add_argument("--output", help="json file to write the results, printed if not given.")
+    parser.add_argument("--baseline", help="results of a previous run to compare the latencies with.")
+    args = parser.parse_args()
+
+    rows = SIZES[args.size] if args.size in SIZES else int(args.size)
+    os.makedirs(args.data_dir, exist_ok=True)
+    csv_path = os.path.join(args.data_dir, f"demandas_{rows}_{args.seed}.csv")
+    database_path = os.path.join(args.data_dir, f"demandas_{rows}_{args.seed}.sqlite")
+    if not os.path.exists(csv_path):
+        generate_csv(csv_path, rows, args.seed)
+
+    load = load_database(csv_path, database_path, args.loader_args.split())
+    loaded_rows, values = sample_values(database_path)
+    load["rows_per_second"] = loaded_rows / load["seconds"]
+
+    client = use_database(database_path, args.profile)
+    routes = []
+    for name, template in ROUTES:
+        path = template.format(**values)
+        result = measure_route(client, path, args.requests, clear_cache=not name.endswith("(cached)"))
+        routes.append({"name": name, "path": path, **result})
+    column_store_load = None
+    if args.column_store:
+        column_store_load, column_store_routes = measure_column_store(client, routes, args.requests)
+        routes.extend(column_store_routes)
+    snapshot = measure_snapshot(database_path, args.profile) if args.snapshot else None
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rows": loaded_rows,
+        "profile": args.profile,
+        "loader_args": args.loader_args,
+        "database_mb": os.path.getsize(database_path) / 1024 / 1024,
+        "load": load,
+        "column_store": column_store_load,
+        "snapshot": snapshot,
+        "routes": routes,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
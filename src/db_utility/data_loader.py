@@ -1,15 +1,46 @@
+import argparse
+import io
+import logging
 import os
+import time
 from abc import abstractmethod, ABC
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 
 from sqlalchemy import create_engine, Engine, MetaData, text
+import numpy as np
 import pandas as pd
+
+from flask_api.db.models.demanda import ENCODED_COLUMNS
+from flask_api.db.rollups import build_rollups
+from flask_api.db.search import build_search_index, search_available
+from flask_api.db.snapshot import publish_snapshot
 from settings import DATABASE_PATH
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 100_000
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# Files bigger than this are split in parts at row boundaries when loading in parallel.
+DEFAULT_SPLIT_SIZE = 32 * 1024 * 1024
+# Pragmas used while bulk loading, durability is not needed since a failed load is just run again.
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # 256MB
+    "temp_store": "MEMORY",
+}
+# Pragmas used by the delta load, which writes to a database in use, so it keeps the journal and durability settings.
+DELTA_LOAD_PRAGMAS = {
+    "cache_size": -262144,  # 256MB
+}
+
 
 class DataLoader(ABC):
     """ Loads data from a csv and stores in a database with 'table_name' and 'columns'. """
+    # Column that identifies a row, used as the index of the dataframes and as the conflict target of the delta load.
+    key_column = "demanda_id"
+
     def __init__(self, table_name: str, engine: Engine, columns: List[str] = None, usecols=None):
         self.table_name = table_name
         self.columns = columns
@@ -17,18 +48,136 @@ class DataLoader(ABC):
         self.dataframes = []
         self.engine = engine
         self._script_dir = os.path.dirname(__file__)
+        # codes of the values of the dictionary encoded columns, by column.
+        self._codebooks = {}
+
+    def __getstate__(self):
+        # the loader is sent to worker processes, which only parse and transform data.
+        state = self.__dict__.copy()
+        state["engine"] = None
+        state["dataframes"] = []
+        state["_codebooks"] = {}
+        return state
 
     def load_folder(self, folder_path: str):
-        """ Load data from multiple csvs in a directory. """
-        for file_name in os.listdir(folder_path):
+        """ Load data from multiple csvs in a directory, in the same order as parallel_load_folder. """
+        folder_path = os.path.join(self._script_dir, folder_path)
+        for file_name in sorted(os.listdir(folder_path)):
             if file_name.endswith(".csv"):
                 self.load_data(os.path.join(folder_path, file_name))
 
+    def parallel_load_folder(self, folder_path: str, workers: int = None, split_size: int = DEFAULT_SPLIT_SIZE):
+        """ Load and insert all csvs in a directory using 'workers' processes, see parallel_load_to_database. """
+        folder_path = os.path.join(self._script_dir, folder_path)
+        file_paths = [os.path.join(folder_path, file_name) for file_name in sorted(os.listdir(folder_path))
+                      if file_name.endswith(".csv")]
+        return self.parallel_load_to_database(file_paths, workers, split_size)
+
+    def parallel_load_to_database(self, relative_file_paths: List[str], workers: int = None,
+                                  split_size: int = DEFAULT_SPLIT_SIZE):
+        """
+        Parse and transform csvs in a pool of 'workers' processes (defaults to the cpu count), files bigger than
+        'split_size' bytes are split in parts at row boundaries. This process is the only writer, inserting the parts
+        in order as they are ready, so the database is never written concurrently. Returns the number of inserted rows.
+        """
+        parts = []
+        for relative_file_path in relative_file_paths:
+            file_path = os.path.join(self._script_dir, relative_file_path)
+            parts.extend((file_path, start, end) for start, end in self._split_file(file_path, split_size))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = pool.map(self._parse_part, *zip(*parts), range(len(parts)))
+            return self._insert_frames(frames)
+
+    @staticmethod
+    def _split_file(file_path: str, split_size: int):
+        """ Returns (start, end) byte ranges of the file with about 'split_size' bytes, ending at a line break. """
+        file_size = os.path.getsize(file_path)
+        ranges = []
+        with open(file_path, "rb") as csv_file:
+            start = 0
+            while start < file_size:
+                csv_file.seek(min(start + split_size, file_size))
+                csv_file.readline()
+                end = min(csv_file.tell(), file_size)
+                ranges.append((start, end))
+                start = end
+        return ranges
+
+    def _parse_part(self, file_path: str, start: int, end: int, idx: int):
+        """ Read and transform the rows between the 'start' and 'end' bytes, only the first part has the header. """
+        with open(file_path, "rb") as csv_file:
+            csv_file.seek(start)
+            data = io.BytesIO(csv_file.read(end - start))
+        frame = self.read_csv(data) if start == 0 else self.read_csv(data, header=None)
+        return self._transformations(frame, idx)
+
     def load_data(self, relative_file_path: str):
         """ Load data from a specific csv. """
         file_path = os.path.join(self._script_dir, relative_file_path)
-        self.dataframes.append(pd.read_csv(file_path, names=self.columns, encoding="ISO-8859-1", header=1, sep=";",
-                                           index_col="demanda_id", usecols=self.usecols))
+        self.dataframes.append(self.read_csv(file_path))
+
+    def read_csv(self, file_path, header=1, **kwargs):
+        """ Read a csv with the loader columns, extra arguments are passed to pandas. """
+        return pd.read_csv(file_path, names=self.columns, encoding="ISO-8859-1", header=header, sep=";",
+                           index_col=self.key_column, usecols=self.usecols, **kwargs)
+
+    def stream_data_to_database(self, relative_file_path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+        """
+        Read, transform and insert a csv in chunks of 'chunksize' rows, all inside a single transaction.
+        Memory usage is bounded by the chunk size instead of the file size. Returns the number of inserted rows.
+        """
+        file_path = os.path.join(self._script_dir, relative_file_path)
+        chunks = self.read_csv(file_path, chunksize=chunksize)
+        return self._insert_frames(self._transformations(chunk, idx) for idx, chunk in enumerate(chunks))
+
+    def delta_load_to_database(self, relative_file_path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+        """
+        Upsert a csv into the existing table, without dropping it. The csv is first inserted in a temporary staging
+        table, then a single transaction inserts the new rows and updates the rows with any changed column, by
+        'key_column'. Readers see the previous data until that transaction commits. Returns the number of upserted rows.
+        """
+        file_path = os.path.join(self._script_dir, relative_file_path)
+        chunks = self.read_csv(file_path, chunksize=chunksize)
+        staging_table = f"{self.table_name}_staging"
+        start = time.perf_counter()
+        with self.engine.connect() as connection:
+            previous_pragmas = self._set_pragmas(connection, DELTA_LOAD_PRAGMAS)
+            # the temporary table only exists in this connection and is not written to the database file.
+            with connection.begin():
+                connection.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{staging_table}")
+                connection.exec_driver_sql(f"CREATE TEMP TABLE {staging_table} AS "
+                                           f"SELECT * FROM main.{self.table_name} WHERE 0")
+                staged_rows = sum(self._bulk_insert(connection, self._transformations(chunk, idx), staging_table)
+                                  for idx, chunk in enumerate(chunks))
+            logger.info("Staged %d rows in %.2fs.", staged_rows, time.perf_counter() - start)
+
+            with connection.begin():
+                upserted_rows = connection.exec_driver_sql(self._upsert_statement(connection, staging_table)).rowcount
+                self.post_delta_load(connection)
+            connection.exec_driver_sql(f"DROP TABLE temp.{staging_table}")
+            connection.commit()
+            self._set_pragmas(connection, previous_pragmas)
+
+        logger.info("Upserted %d new or changed rows of %d in %.2fs.", upserted_rows, staged_rows,
+                    time.perf_counter() - start)
+        return upserted_rows
+
+    def _upsert_statement(self, connection, staging_table):
+        """ Statement inserting the staged rows, or updating the existing rows when any column value changed. """
+        columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA main.table_info({self.table_name})")]
+        values = [column for column in columns if column != self.key_column]
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in values)
+        # 'IS NOT' also compares nulls.
+        changed = " OR ".join(f"{self.table_name}.{column} IS NOT excluded.{column}" for column in values)
+        column_list = ", ".join(columns)
+        # 'WHERE true' is needed by the sqlite parser to tell the 'ON CONFLICT' apart from a join constraint.
+        return (f"INSERT INTO main.{self.table_name} ({column_list}) "
+                f"SELECT {column_list} FROM temp.{staging_table} WHERE true "
+                f"ON CONFLICT ({self.key_column}) DO UPDATE SET {assignments} WHERE {changed}")
+
+    def post_delta_load(self, connection):
+        """ Steps to run in the transaction that applied the delta load, after the rows were upserted. """
 
     def apply_transformations(self):
         """ Apply custom transformations to the data. """
@@ -38,53 +187,218 @@ class DataLoader(ABC):
     def _transformations(self, data, idx):
         return data
 
+    def post_load(self):
+        """ Steps to run once all the data was inserted in the database. """
+        self.create_indexes()
+
+    def create_indexes(self):
+        """
+        Create the indexes in 'schema/<table_name>_indexes.sql', if it exists. Indexes are created after the data is
+        inserted, building them at once is faster than updating them on every insert.
+        """
+        indexes_path = f"{self._script_dir}/schema/{self.table_name.lower()}_indexes.sql"
+        if not os.path.exists(indexes_path):
+            return
+        with open(indexes_path, "r") as sql_indexes_file:
+            statements = [statement for statement in sql_indexes_file.read().split(";") if statement.strip()]
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+            # update the statistics used by the query planner to choose the indexes.
+            connection.execute(text("ANALYZE"))
+
     def insert_data_to_database(self):
-        """ Insert the loaded data to the database table. """
-        for data in self.dataframes:
-            data.to_sql(self.table_name, con=engine, if_exists="append")
-        engine.dispose()
+        """ Insert the loaded and transformed dataframes to the database table, returns the number of inserted rows. """
+        return self._insert_frames(self.dataframes)
+
+    def _insert_frames(self, frames):
+        """ Insert an iterable of dataframes in a single transaction using bulk load pragmas. """
+        start = time.perf_counter()
+        total_rows = 0
+        with self.engine.connect() as connection:
+            previous_pragmas = self._set_pragmas(connection, BULK_LOAD_PRAGMAS)
+            with connection.begin():
+                for data in frames:
+                    total_rows += self._bulk_insert(connection, data)
+            self._set_pragmas(connection, previous_pragmas)
+
+        self._report_rate(total_rows, time.perf_counter() - start)
+        return total_rows
+
+    def _bulk_insert(self, connection, data, table_name=None):
+        """ Insert a dataframe with a single executemany, returns the number of inserted rows. """
+        data = data.reset_index()
+        for column in data.select_dtypes(include="category").columns:
+            data[column] = self._encode(connection, column, data[column])
+        for column in data.select_dtypes(include="datetime").columns:
+            # same text format used by sqlalchemy to store datetimes in sqlite.
+            data[column] = data[column].dt.strftime(SQLITE_DATETIME_FORMAT)
+        # the sqlite driver only understands None as null.
+        data = data.astype(object).where(data.notna(), None)
+        columns = ", ".join(data.columns)
+        placeholders = ", ".join("?" * len(data.columns))
+        connection.exec_driver_sql(f"INSERT INTO {table_name or self.table_name} ({columns}) VALUES ({placeholders})",
+                                   list(data.itertuples(index=False, name=None)))
+        return len(data)
+
+    def _encode(self, connection, column, values: pd.Series):
+        """
+        Returns the codes of a categorical column in its lookup table, '<table_name>_<column>'. The categories of each
+        dataframe have their own codes, only the categories not seen before are added to the lookup table, in the order
+        they first appear in the rows, so a file gets the same codes whether it's loaded whole, in chunks or in parts.
+        """
+        codebook = self._codebooks.setdefault(column, {})
+        lookup_table = f"{self.table_name}_{column}"
+        categories = values.cat.categories
+        category_codes = values.cat.codes.to_numpy()
+        new_values = [categories[code] for code in pd.unique(category_codes[category_codes >= 0])
+                      if categories[code] not in codebook]
+        if new_values:
+            connection.exec_driver_sql(f"INSERT OR IGNORE INTO {lookup_table} (value) VALUES (?)",
+                                       [(value,) for value in new_values])
+            # lookup tables are small, reading the whole table is simpler than selecting the new values.
+            codebook.update(connection.exec_driver_sql(f"SELECT value, code FROM {lookup_table}").all())
+        # the categorical codes index the categories, null values have the code -1 and read the extra 0, then masked.
+        codes = np.array([codebook[value] for value in values.cat.categories] + [0], dtype=np.int64)
+        return pd.Series(codes[values.cat.codes.to_numpy()], index=values.index, dtype="Int64").mask(values.isna())
+
+    @staticmethod
+    def _set_pragmas(connection, pragmas):
+        """ Set sqlite pragmas in the connection, returns the previous values so they can be restored. """
+        previous_pragmas = {}
+        for pragma, value in pragmas.items():
+            previous_pragmas[pragma] = connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            connection.exec_driver_sql(f"PRAGMA {pragma} = {value}")
+        # pragmas are not transactional, this only closes the implicit transaction of the connection.
+        connection.commit()
+        return previous_pragmas
+
+    @staticmethod
+    def _report_rate(total_rows, elapsed):
+        logger.info("Inserted %d rows in %.2fs (%.0f rows/s).", total_rows, elapsed,
+                    total_rows / elapsed if elapsed > 0 else 0)
 
     def create_table(self, drop_if_exists):
-        """ Create a new database table. """
+        """ Create the database table, if it doesn't exist or 'drop_if_exists' is set. """
         metadata = MetaData()
-        metadata.reflect(bind=engine)
+        metadata.reflect(bind=self.engine)
 
         existing_table = metadata.tables.get(self.table_name)
         if existing_table is not None and drop_if_exists:
-            existing_table.drop(bind=engine)
+            existing_table.drop(bind=self.engine)
 
-        with engine.connect() as connection:
-            with open(f"{self._script_dir}/schema/{self.table_name.lower()}.sql", "r") as sql_schema_file:
-                connection.execute(text(sql_schema_file.read()))
-                connection.commit()
+        with open(f"{self._script_dir}/schema/{self.table_name.lower()}.sql", "r") as sql_schema_file:
+            statements = [statement for statement in sql_schema_file.read().split(";") if statement.strip()]
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
 
 
 class DemandasLoader(DataLoader):
     """ Loader with special transformation specific to the demandas csv """
+    # Some cells may not contain the time field.
+    DATE_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y")
+
+    def post_load(self):
+        """ Create the indexes, build the rollup tables and the search index of Demandas. """
+        super().post_load()
+        with self.engine.begin() as connection:
+            build_rollups(connection)
+            build_search_index(connection)
+
+    def post_delta_load(self, connection):
+        """ Rebuild the rollup tables in the same transaction, the search index is kept in sync by its triggers. """
+        build_rollups(connection)
+        if not search_available(connection):
+            build_search_index(connection)
+
+    def create_table(self, drop_if_exists):
+        super().create_table(drop_if_exists)
+        # tables created before 'ultima_atualizacao' was kept by the loader don't have the column.
+        with self.engine.begin() as connection:
+            columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({self.table_name})")]
+            if "ultima_atualizacao" not in columns:
+                connection.exec_driver_sql(f"ALTER TABLE {self.table_name} ADD COLUMN ultima_atualizacao DATE")
+
     def _transformations(self, data, idx):
-        data = data.drop(columns=["competencia", "ultima_atualizacao"], axis=1)
-        data['data_atendimento_demanda'] = data['data_atendimento_demanda'].map(self.convert_data_to_iso)
+        data = data.drop(columns=["competencia"], axis=1)
+        data['data_atendimento_demanda'] = self.parse_dates(data['data_atendimento_demanda'], idx)
+        data['ultima_atualizacao'] = self.parse_dates(data['ultima_atualizacao'], idx)
+        # the text columns are stored as the codes of their lookup tables, see _encode.
+        for column in ENCODED_COLUMNS:
+            data[column] = data[column].astype("category")
         return data
 
-    @staticmethod
-    def convert_data_to_iso(date_string):
-        try:
-            parsed_date = datetime.strptime(date_string, "%d/%m/%Y %H:%M:%S")
-        except ValueError:
-            # Some cells may not contain the time field.
-            parsed_date = datetime.strptime(date_string, "%d/%m/%Y")
-        return parsed_date.isoformat()
+    @classmethod
+    def parse_dates(cls, dates: pd.Series, idx=0):
+        """ Parse a column of date strings trying each of the DATE_FORMATS, values that don't match are set as NaT. """
+        parsed_dates = pd.Series(pd.NaT, index=dates.index, dtype="datetime64[ns]")
+        for date_format in cls.DATE_FORMATS:
+            missing = parsed_dates.isna() & dates.notna()
+            if not missing.any():
+                break
+            parsed_dates[missing] = pd.to_datetime(dates[missing], format=date_format, errors="coerce")
 
+        unparsed = int((parsed_dates.isna() & dates.notna()).sum())
+        if unparsed > 0:
+            logger.warning("Chunk %d: %d dates could not be parsed and were set to null.", idx, unparsed)
+        return parsed_dates
+
+
+DEMANDAS_COLUMNS = ["ans", "razao_social", "beneficiarios", "demanda_id", "data_atendimento_demanda",
+                    "classificacao_demanda", "natureza_demanda", "subtema_demanda", "competencia", "ultima_atualizacao"]
 
-if __name__ == '__main__':
-    engine = create_engine(DATABASE_PATH, echo=True)
 
-    columns = ["ans", "razao_social", "beneficiarios", "demanda_id", "data_atendimento_demanda",
-               "classificacao_demanda", "natureza_demanda", "subtema_demanda", "competencia", "ultima_atualizacao"]
-    demandas_loader = DemandasLoader("Demandas", engine, columns)
-    demandas_loader.create_table(True)
-    demandas_loader.load_data("raw_data/dados-gerais-das-reclamacoes-por-operadora.csv")
-    demandas_loader.apply_transformations()
-    demandas_loader.insert_data_to_database()
+def main(argv=None):
+    """ Command line of the loader, 'argv' defaults to the process arguments. """
+    parser = argparse.ArgumentParser(description="Load the demandas csv into the database.")
+    parser.add_argument("--file", default="raw_data/dados-gerais-das-reclamacoes-por-operadora.csv",
+                        help="csv path, relative to the db_utility folder.")
+    parser.add_argument("--database", default=DATABASE_PATH, help="sqlalchemy url of the database.")
+    parser.add_argument("--folder", help="load every csv in this folder instead of a single file.")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="rows per chunk when streaming the csv, 0 loads the whole file in memory.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse and transform the csvs, more than 1 enables parallel loading.")
+    parser.add_argument("--delta", action="store_true",
+                        help="upsert the new and changed rows of --file into the existing table, without reloading it.")
+    parser.add_argument("--publish-snapshot", metavar="PATH",
+                        help="after loading, publish a compacted read only copy of the database to PATH, for the API "
+                             "snapshot mode (SNAPSHOT_PATH).")
+    args = parser.parse_args(argv)
 
-    engine.dispose()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    engine = create_engine(args.database)
+
+    demandas_loader = DemandasLoader("Demandas", engine, DEMANDAS_COLUMNS)
+    if args.delta:
+        demandas_loader.create_table(False)
+        demandas_loader.delta_load_to_database(args.file, args.chunksize or DEFAULT_CHUNKSIZE)
+        # only creates the indexes missing in a new table and updates the statistics.
+        demandas_loader.create_indexes()
+    else:
+        demandas_loader.create_table(True)
+        if args.workers > 1:
+            if args.folder is not None:
+                demandas_loader.parallel_load_folder(args.folder, args.workers)
+            else:
+                demandas_loader.parallel_load_to_database([args.file], args.workers)
+        elif args.folder is not None:
+            demandas_loader.load_folder(args.folder)
+            demandas_loader.apply_transformations()
+            demandas_loader.insert_data_to_database()
+        elif args.chunksize > 0:
+            demandas_loader.stream_data_to_database(args.file, args.chunksize)
+        else:
+            demandas_loader.load_data(args.file)
+            demandas_loader.apply_transformations()
+            demandas_loader.insert_data_to_database()
+        demandas_loader.post_load()
+
+    if args.publish_snapshot is not None:
+        publish_snapshot(engine, args.publish_snapshot)
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
-CREATE TABLE Demandas (
+CREATE TABLE IF NOT EXISTS Demandas (
     demanda_id INTEGER PRIMARY KEY,
     ans INTEGER NOT NULL ,
-    razao_social VARCHAR(140) NOT NULL,
+    razao_social INTEGER NOT NULL,
     beneficiarios INTEGER,
     data_atendimento_demanda DATE,
-    classificacao_demanda VARCHAR(25),
-    natureza_demanda VARCHAR(25),
-    subtema_demanda VARCHAR(250)
-)
\ No newline at end of file
+    classificacao_demanda INTEGER,
+    natureza_demanda INTEGER,
+    subtema_demanda INTEGER,
+    ultima_atualizacao DATE
+);
+-- Lookup tables of the dictionary encoded columns, the Demandas columns store the codes.
+CREATE TABLE IF NOT EXISTS Demandas_razao_social (code INTEGER PRIMARY KEY, value VARCHAR(140) NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS Demandas_classificacao_demanda (code INTEGER PRIMARY KEY, value VARCHAR(25) NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS Demandas_natureza_demanda (code INTEGER PRIMARY KEY, value VARCHAR(25) NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS Demandas_subtema_demanda (code INTEGER PRIMARY KEY, value VARCHAR(250) NOT NULL UNIQUE);
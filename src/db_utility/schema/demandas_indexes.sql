@@ -0,0 +1,11 @@
+-- replaced by the covering index below.
+DROP INDEX IF EXISTS ix_demandas_ans;
+CREATE INDEX IF NOT EXISTS ix_demandas_ans_data_atendimento_demanda ON Demandas (ans, data_atendimento_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_razao_social ON Demandas (razao_social);
+CREATE INDEX IF NOT EXISTS ix_demandas_data_atendimento_demanda ON Demandas (data_atendimento_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_classificacao_demanda ON Demandas (classificacao_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_natureza_demanda ON Demandas (natureza_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_subtema_demanda ON Demandas (subtema_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_razao_social_classificacao_demanda ON Demandas (razao_social, classificacao_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_classificacao_demanda_natureza_demanda ON Demandas (classificacao_demanda, natureza_demanda);
+CREATE INDEX IF NOT EXISTS ix_demandas_razao_social_data_atendimento_demanda ON Demandas (razao_social, data_atendimento_demanda)
\ No newline at end of file
@@ -1,16 +1,73 @@
-from flask import Flask
+from flask import Flask, Response, request
 import flask_api.db.database as db
+from flask_api import metrics
+from flask_api.db.column_store import column_store
+from flask_api.db.data_version import data_version
+from flask_api.db.snapshot import snapshot
 from flask_api.routes.demandas import demandas_bp
+from flask_api.routes.demandas_bulk import demandas_bulk_bp
+from flask_api.routes.demandas_export import demandas_export_bp
+from flask_api.routes.metrics import metrics_bp
+from flask_api.utils import InvalidQuery
 
 app = Flask(__name__)
-db.init_db()
+if snapshot.enabled:
+    # the snapshot is published with its schema and can't be changed.
+    snapshot.open()
+else:
+    db.init_db()
+if column_store.enabled:
+    column_store.refresh()
 
 app.register_blueprint(demandas_bp)
+app.register_blueprint(demandas_bulk_bp)
+app.register_blueprint(demandas_export_bp)
+app.register_blueprint(metrics_bp)
+
+
+@app.before_request
+def start_request_timings():
+    metrics.start_request()
+
+
+@app.before_request
+def use_latest_snapshot():
+    if not snapshot.enabled:
+        return None
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        return Response("The API is serving a read only snapshot, writes are not allowed.", status=405,
+                        headers={"Allow": "GET, HEAD, OPTIONS"})
+    snapshot.check()
+    return None
+
+
+@app.before_request
+def check_data_version():
+    # a snapshot never changes, a new one clears the count cache when it's opened.
+    if not snapshot.enabled:
+        data_version.check(db.read_engine)
+
+
+@app.after_request
+def finish_request_timings(response):
+    return metrics.finish_request(response, request.endpoint)
+
+
+@app.errorhandler(InvalidQuery)
+def invalid_query(e):
+    return Response(f"Invalid request: {e}.", status=400)
+
+
+@app.errorhandler(db.QueryTimeout)
+def query_timeout(e):
+    return Response(f"Query timeout: {e}.", status=503)
 
 
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     db.session.remove()
+    db.read_session.remove()
+    metrics.end_request()
 
 
 if __name__ == '__main__':
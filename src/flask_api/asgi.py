@@ -0,0 +1,220 @@
+"""
+Async version of the /demandas routes, served with an asgi server:
+    uvicorn flask_api.asgi:app --workers N
+It uses the same Demanda model, query builders, count cache and rollups of the flask app, but the database is accessed
+through an async engine, so a worker is not blocked while waiting for the database. The dynamic queries have the same
+column validation and MAX_QUERY_ROWS limit, and the requests the same 'Server-Timing' header and /metrics histograms.
+Only the routes below are served, and the query timeout, the read only pool, the column store, the data version check,
+group commit and the snapshot mode of the flask app are not supported.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import delete
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.responses import Response, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from flask_api import metrics
+from flask_api.cache import count_cache
+from flask_api.db import rollups
+import flask_api.db.database_async as db
+from flask_api.db.models import Demanda
+from flask_api.routes.demandas import create_demandas_query, create_count_query, find_count_rollup, \
+    create_page_query, create_page, parse_page_args, parse_fields
+from flask_api.utils import create_query_key, get_group_columns, InvalidQuery, limit_rows, check_row_limit
+from settings import STREAM_BATCH_SIZE
+
+
+def dumps(obj):
+    # same format of the flask json provider.
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+def json_response(obj, status_code=200, headers=None):
+    with metrics.timed_serialization():
+        content = dumps(obj) + "\n"
+    return Response(content, status_code=status_code, headers=headers, media_type="application/json")
+
+
+class RequestTimingsMiddleware:
+    """ Times the requests like the flask app, adding the 'Server-Timing' header when the response starts. """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                # the router sets the endpoint in the scope.
+                endpoint = scope.get("endpoint")
+                server_timing = metrics.record_request(endpoint.__name__ if endpoint is not None else None)
+                MutableHeaders(scope=message)["Server-Timing"] = server_timing
+            await send(message)
+
+        metrics.start_request()
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            metrics.end_request()
+
+
+async def demandas(request):
+    """ Same as the flask /demandas route. """
+    args = request.query_params
+    try:
+        fields = parse_fields(args)
+    except ValueError as e:
+        return PlainTextResponse(f"Invalid request: {e}.", status_code=400)
+    query = create_demandas_query(args, fields)
+
+    if args.get("stream", "").lower() == "true":
+        return StreamingResponse(stream_demandas(query, fields), media_type="application/json")
+
+    async with db.session_factory() as session:
+        if "limit" in args or "after" in args:
+            try:
+                after, limit = parse_page_args(args)
+            except ValueError as e:
+                return PlainTextResponse(f"Invalid request: {e}.", status_code=400)
+            result = (await session.execute(create_page_query(query, after, limit))).all()
+            return json_response(create_page(result, limit, fields))
+
+        result = check_row_limit((await session.execute(limit_rows(query))).all())
+    return json_response(Demanda.serialize_rows(result, fields))
+
+
+async def stream_demandas(query, fields=None):
+    """ Yields the query result as a json array, fetching rows in batches from a server side cursor. """
+    async with db.session_factory() as session:
+        result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        separator = "["
+        async for partition in result.partitions():
+            yield separator + dumps(Demanda.serialize_rows(partition, fields))[1:-1]
+            separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+async def demandas_count(request):
+    """ Same as the flask /demandas/count route. """
+    args = request.query_params
+    cache_key = create_query_key(args)
+    cached_result = count_cache.get(cache_key)
+    if cached_result is not None:
+        return json_response(cached_result, headers={"X-Cache": "HIT"})
+    generation = count_cache.generation
+
+    group_columns = get_group_columns(args)
+    async with db.session_factory() as session:
+        rollup = await session.run_sync(
+            lambda sync_session: find_count_rollup(sync_session.connection(), group_columns, args))
+        query = create_count_query(group_columns, rollup, args)
+        result = [row._asdict() for row in check_row_limit((await session.execute(limit_rows(query))).all())]
+
+    count_cache.set(cache_key, result, generation)
+    return json_response(result, headers={"X-Cache": "MISS"})
+
+
+async def demandas_count_cache(request):
+    return json_response(count_cache.stats())
+
+
+async def metrics_summary(request):
+    """ Same as the flask /metrics route. """
+    return json_response(metrics.metrics.snapshot())
+
+
+async def apply_rollup_changes(session, rows, sign):
+    await session.run_sync(lambda sync_session: rollups.apply_changes(sync_session.connection(), rows, sign))
+
+
+async def commit_changes(session):
+    await session.commit()
+    count_cache.clear()
+
+
+async def demandas_create_new(request):
+    """ Same as the flask /demandas/add route. """
+    data = await request.form()
+    async with db.session_factory() as session:
+        try:
+            data_atendimento_demanda = data.get("data_atendimento_demanda")
+            if data_atendimento_demanda is not None:
+                data_atendimento_demanda = datetime.strptime(data_atendimento_demanda, "%Y-%m-%d %H:%M:%S")
+            new_demanda = Demanda(ans=data['ans'],
+                                  razao_social=data['razao_social'],
+                                  beneficiarios=data.get("beneficiarios"),
+                                  data_atendimento_demanda=data_atendimento_demanda,
+                                  classificacao_demanda=data.get("classificacao_demanda"),
+                                  natureza_demanda=data.get("natureza_demanda"),
+                                  subtema_demanda=data.get("subtema_demanda"))
+            session.add(new_demanda)
+            await apply_rollup_changes(session, [rollups.row_values(new_demanda)], 1)
+        except KeyError as e:
+            return PlainTextResponse(f"Missing required field: {e.args}.", status_code=400)
+        except Exception as e:
+            return PlainTextResponse(f"Invalid request: {e}.", status_code=400)
+
+        await commit_changes(session)
+    return PlainTextResponse("Item created successfully.", status_code=201)
+
+
+async def demandas_update(request):
+    """ Same as the flask /demandas/update/<id> route. """
+    demanda_id = request.path_params["demanda_id"]
+    data = await request.form()
+    async with db.session_factory() as session:
+        demanda_to_update = await session.get(Demanda, demanda_id)
+        if demanda_to_update is None:
+            return PlainTextResponse(f"Couldn't find object with id: {demanda_id}", status_code=404)
+        old_values = rollups.row_values(demanda_to_update)
+
+        for key, _ in Demanda.serialized_columns():
+            new_value = data.get(key)
+            if new_value is not None:
+                try:
+                    if key == 'data_atendimento_demanda':
+                        new_value = datetime.strptime(new_value, "%Y-%m-%d %H:%M:%S")
+                    setattr(demanda_to_update, key, new_value)
+                except Exception as e:
+                    return PlainTextResponse(f"Invalid request: {e}.", status_code=400)
+        await apply_rollup_changes(session, [old_values], -1)
+        await apply_rollup_changes(session, [rollups.row_values(demanda_to_update)], 1)
+        await commit_changes(session)
+    return PlainTextResponse("Item updated successfully.")
+
+
+async def demanda_delete(request):
+    """ Same as the flask /demandas/delete/<id> route. """
+    demanda_id = request.path_params["demanda_id"]
+    async with db.session_factory() as session:
+        query = delete(Demanda).where(Demanda.demanda_id == demanda_id).returning(*Demanda.__table__.columns)
+        deleted_rows = (await session.execute(query)).mappings().all()
+        await apply_rollup_changes(session, deleted_rows, -1)
+        await commit_changes(session)
+
+    if len(deleted_rows) == 0:
+        return PlainTextResponse(f"Couldn't find object with id: {demanda_id}", status_code=404)
+    return PlainTextResponse("Item deleted successfully.")
+
+
+async def invalid_query(request, e):
+    return PlainTextResponse(f"Invalid request: {e}.", status_code=400)
+
+
+app = Starlette(exception_handlers={InvalidQuery: invalid_query}, middleware=[Middleware(RequestTimingsMiddleware)],
+                routes=[
+                    Route('/demandas', demandas),
+                    Route('/demandas/count', demandas_count),
+                    Route('/demandas/count/cache', demandas_count_cache),
+                    Route('/demandas/add', demandas_create_new, methods=['POST']),
+                    Route('/demandas/update/{demanda_id:int}', demandas_update, methods=['PUT']),
+                    Route('/demandas/delete/{demanda_id:int}', demanda_delete, methods=['DELETE']),
+                    Route('/metrics', metrics_summary),
+                ])
@@ -0,0 +1,56 @@
+""" In process cache for query results. """
+
+from collections import OrderedDict
+from threading import Lock
+
+from settings import COUNT_CACHE_SIZE
+
+
+class LRUCache:
+    """
+    Least recently used cache with at most 'max_size' entries, safe to use from multiple threads.
+    Every clear starts a new generation, values computed before it are not stored, so a result read before a write
+    can't be cached after the write invalidated the cache.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """ Returns the cached value of 'key' or None, counting it as a hit or a miss. """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+            return None
+
+    def set(self, key, value, generation: int):
+        """ Store 'value' if the cache wasn't cleared since 'generation', evicting the least recently used entry. """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "invalidations": self._invalidations,
+                    "size": len(self._entries), "max_size": self.max_size}
+
+
+count_cache = LRUCache(COUNT_CACHE_SIZE)
@@ -0,0 +1,202 @@
+"""
+In memory column store of Demandas, used to answer /demandas/count without sqlite. Every column that can be grouped
+or filtered is kept as a numpy array of small integer codes, one per row, and the list of the distinct values of the
+codes. The codes follow the order of the values (nulls first, the encoded columns by their decoded text, not by their
+lookup codes), so the groups are returned sorted by the group values, in the same order as the sql count query.
+
+A snapshot is valid while the count cache generation doesn't change. The writes of the API clear the cache, and so
+does a change of 'PRAGMA data_version' (see data_version.py), so the writes of other workers and processes are seen too.
+An outdated snapshot is reloaded in a background thread and the counts use sqlite until it's ready.
+"""
+
+import logging
+import re
+from itertools import chain
+from threading import Lock, Thread
+
+import numpy as np
+from sqlalchemy import select
+
+import flask_api.db.database as db
+from flask_api.cache import count_cache
+from flask_api.db.dictionary import encoded_columns
+from flask_api.db.models import Demanda
+from settings import COLUMN_STORE
+
+logger = logging.getLogger(__name__)
+
+# Integer columns that are kept besides the dictionary encoded ones.
+INTEGER_COLUMNS = ("ans", "beneficiarios")
+
+# Filter values compared to integer columns, other values are converted by sqlite affinity rules and use sqlite.
+_INTEGER = re.compile(r"-?[0-9]+")
+
+# Rows read from sqlite at a time when loading a snapshot.
+LOAD_BATCH_SIZE = 100000
+
+
+class EncodedColumn:
+    """ The 'codes' of a column, one per row, and the 'values' of the codes. The code 0 is null. """
+    def __init__(self, codes, values: list, is_text: bool):
+        self.codes = codes
+        self.values = values
+        self.is_text = is_text
+        self._value_codes = {value: code for code, value in enumerate(values) if value is not None}
+
+    @classmethod
+    def from_stored(cls, nulls, stored, decode=None):
+        """ Encodes the 'stored' values of a column, 'decode' maps them to the values returned by the queries. """
+        distinct, inverse = np.unique(stored[~nulls], return_inverse=True)
+        values = distinct.tolist()
+        if decode is not None:
+            # sorted by the decoded text, python and sqlite compare strings by their code points.
+            values = [decode[value] for value in values]
+            order = sorted(range(len(values)), key=values.__getitem__)
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            inverse = rank[inverse]
+            values = [values[i] for i in order]
+        codes = np.zeros(len(stored), dtype=np.min_scalar_type(len(distinct)))
+        codes[~nulls] = inverse + 1
+        return cls(codes, [None] + values, is_text=decode is not None)
+
+    def filter_codes(self, values):
+        """ Returns the codes of the filter 'values', or None if they aren't compared like sqlite would. """
+        if self.is_text:
+            return [self._value_codes[value] for value in values if value in self._value_codes]
+        if not all(_INTEGER.fullmatch(value) for value in values):
+            return None
+        return [self._value_codes[int(value)] for value in values if int(value) in self._value_codes]
+
+
+class Snapshot:
+    """ Encoded columns of Demandas at the count cache 'generation', read from 'engine'. """
+    def __init__(self, engine, generation, rows, columns: dict):
+        self.engine = engine
+        self.generation = generation
+        self.rows = rows
+        self.columns = columns
+
+    @classmethod
+    def load(cls, connection, generation):
+        """ Reads the columns from 'connection' in a single scan of the table, in batches of LOAD_BATCH_SIZE rows. """
+        table = Demanda.__table__
+        lookups = {column.key: column.type.lookup_table for column in encoded_columns(table)}
+        names = [*lookups, *INTEGER_COLUMNS]
+        # written as text, so the encoded columns are read as their stored codes instead of being decoded.
+        selected = ", ".join(f"{name} IS NULL, ifnull({name}, 0)" for name in names)
+        result = connection.exec_driver_sql(f"SELECT {selected} FROM {table.name}")
+        nulls = {name: [] for name in names}
+        stored = {name: [] for name in names}
+        for rows in result.partitions(LOAD_BATCH_SIZE):
+            data = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2 * len(names))
+            for i, name in enumerate(names):
+                nulls[name].append(data[:, 2 * i].astype(bool))
+                stored[name].append(data[:, 2 * i + 1])
+
+        columns = {}
+        for name in names:
+            decode = None
+            if name in lookups:
+                decode = dict(connection.execute(select(lookups[name].c.code, lookups[name].c.value)).all())
+            columns[name] = EncodedColumn.from_stored(np.concatenate(nulls[name] or [np.zeros(0, dtype=bool)]),
+                                                      np.concatenate(stored[name] or [np.zeros(0, dtype=np.int64)]),
+                                                      decode)
+            # the batches of a column are released as soon as it's encoded.
+            del nulls[name], stored[name]
+        return cls(connection.engine, generation, len(columns[names[0]].codes), columns)
+
+    def nbytes(self):
+        """ Memory used by the code arrays. """
+        return sum(column.codes.nbytes for column in self.columns.values())
+
+    def count(self, group_columns, filters):
+        """
+        Returns the count of rows grouped by 'group_columns' and filtered by 'filters' (column to the list of values),
+        serialized like the rows of the sql count, or None if the query can't be answered by the snapshot.
+        """
+        if not all(column in self.columns for column in [*group_columns, *filters]) \
+                or len(set(group_columns)) != len(group_columns):
+            return None
+        mask = None
+        for column, values in filters.items():
+            codes = self.columns[column].filter_codes(values)
+            if codes is None:
+                return None
+            column_mask = np.isin(self.columns[column].codes, codes)
+            mask = column_mask if mask is None else mask & column_mask
+
+        if not group_columns:
+            return [{"total": self.rows if mask is None else int(np.count_nonzero(mask))}]
+
+        sizes = [len(self.columns[column].values) for column in group_columns]
+        if np.prod(sizes, dtype=float) >= 2 ** 62:
+            return None
+        # the group key of a row combines the codes of its columns, in the order of the columns.
+        keys = np.zeros(self.rows if mask is None else np.count_nonzero(mask), dtype=np.int64)
+        for column, size in zip(group_columns, sizes):
+            codes = self.columns[column].codes
+            keys = keys * size + (codes if mask is None else codes[mask])
+
+        groups = int(np.prod(sizes))
+        if groups <= len(keys):
+            # few groups: counted directly by key, without sorting the keys.
+            counts = np.bincount(keys, minlength=groups)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+
+        group_values = []
+        for column, size in reversed(list(zip(group_columns, sizes))):
+            keys, codes = np.divmod(keys, size)
+            values = self.columns[column].values
+            group_values.insert(0, [values[code] for code in codes.tolist()])
+        return [{"total": total, **dict(zip(group_columns, row))}
+                for total, *row in zip(counts.tolist(), *group_values)]
+
+
+class ColumnStore:
+    """ The current snapshot of Demandas, enabled by the COLUMN_STORE setting. """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.snapshot = None
+        self._loading = False
+        self._lock = Lock()
+
+    def current(self, engine):
+        """ Returns the snapshot of the current data of 'engine', or None and starts reloading it if it's outdated. """
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.engine is engine and snapshot.generation == count_cache.generation:
+            return snapshot
+        self.refresh(engine)
+        return None
+
+    def load(self, connection):
+        """ Loads the snapshot from 'connection', in the calling thread. """
+        generation = count_cache.generation
+        snapshot = Snapshot.load(connection, generation)
+        self.snapshot = snapshot
+        logger.info("Column store loaded %d rows in %.1f MB", snapshot.rows, snapshot.nbytes() / 1024 / 1024)
+        return snapshot
+
+    def refresh(self, engine=None):
+        """ Loads a new snapshot in a background thread, unless one is already loading. """
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        Thread(target=self._load_in_background, args=(engine or db.read_engine,), daemon=True).start()
+
+    def _load_in_background(self, engine):
+        try:
+            with engine.connect() as connection:
+                self.load(connection)
+        except Exception:
+            logger.exception("Failed to load the column store")
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+column_store = ColumnStore(COLUMN_STORE)
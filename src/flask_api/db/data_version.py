@@ -0,0 +1,54 @@
+"""
+Detects the writes committed to the database by other connections: other workers, the data loader ('--delta',
+rebuilt rollups or search table) or any other process. A connection of the engine is kept only to read
+'PRAGMA data_version', which changes when another connection commits to the database file. A change clears the count
+cache, which starts a new generation: the column store, the rollups and the search availability are valid for a
+generation, so they are reloaded or checked again.
+"""
+
+import logging
+from threading import Lock
+
+from flask_api.cache import count_cache
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersion:
+    """ The 'PRAGMA data_version' of the database of the engine last checked. """
+    def __init__(self):
+        self.engine = None
+        self.version = None
+        self._connection = None
+        self._lock = Lock()
+
+    def check(self, engine):
+        """ Clears the count cache if another connection committed to the database of 'engine' since the last check. """
+        with self._lock:
+            if engine is not self.engine:
+                self._close()
+                self._connection = engine.raw_connection()
+                self.engine = engine
+                self.version = self._read()
+                return
+            version = self._read()
+            if version != self.version:
+                self.version = version
+                logger.info("The database was changed by another connection, clearing the count cache")
+                count_cache.clear()
+
+    def _read(self):
+        cursor = self._connection.cursor()
+        try:
+            return cursor.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            cursor.close()
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+        self.engine = None
+
+
+data_version = DataVersion()
@@ -1,17 +1,102 @@
-from sqlalchemy import create_engine
+import sqlite3
+import time
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 
-import logging
+from settings import DATABASE_PATH, DATABASE_PROFILES, DATABASE_PROFILE, QUERY_TIMEOUT_MS, STATEMENT_CACHE_SIZE
+
+# Pragmas that can't be set by read only connections, they are set by the write connections.
+WRITE_ONLY_PRAGMAS = {"journal_mode"}
+# Sqlite virtual machine instructions between the checks of the query timeout.
+PROGRESS_HANDLER_STEPS = 10000
+
+
+def set_pragmas_on_connect(engine, pragmas, read_only=False):
+    """ Set the sqlite 'pragmas' on every new connection of 'engine'. """
+    if read_only:
+        pragmas = {pragma: value for pragma, value in pragmas.items() if pragma not in WRITE_ONLY_PRAGMAS}
+        pragmas["query_only"] = "ON"
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+
+class QueryTimeout(Exception):
+    """ A statement that ran for longer than the query timeout and was interrupted by sqlite. """
+
+
+def set_query_timeout(engine, timeout_ms):
+    """
+    Interrupt the statements of 'engine' that take more than 'timeout_ms' to return their first row, which is when
+    sqlite does the work of sorts and groups, raising QueryTimeout. A sqlite progress handler, called every
+    PROGRESS_HANDLER_STEPS virtual machine instructions, checks the deadline of the running statement.
+    """
+    if not timeout_ms:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_progress_handler(dbapi_connection, connection_record):
+        deadline = connection_record.info["query_deadline"] = [None]
+        # a true return value interrupts the statement.
+        dbapi_connection.set_progress_handler(lambda: deadline[0] is not None and time.monotonic() > deadline[0],
+                                              PROGRESS_HANDLER_STEPS)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_deadline(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_deadline"][0] = time.monotonic() + timeout_ms / 1000
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def clear_deadline(conn, cursor, statement, parameters, context, executemany):
+        # fetching the next rows is not limited, a slow client reading a stream doesn't interrupt it.
+        conn.info["query_deadline"][0] = None
+
+    @event.listens_for(engine, "handle_error")
+    def raise_timeout(exception_context):
+        if exception_context.connection is None:
+            return None
+        timed_out = exception_context.connection.info["query_deadline"][0] is not None \
+            and isinstance(exception_context.original_exception, sqlite3.OperationalError) \
+            and str(exception_context.original_exception) == "interrupted"
+        exception_context.connection.info["query_deadline"][0] = None
+        if timed_out:
+            return QueryTimeout(f"the query ran for more than {timeout_ms:g} ms")
+        return None
+
 
-from settings import DATABASE_PATH
+def create_profile_engine(database_path, profile, read_only=False, immutable=False):
+    """
+    Create an engine with the pool size and pragmas of 'profile', 'read_only' opens the database in read only mode.
+    'immutable' read only databases are never changed, so sqlite reads them without locking or checking for changes.
+    """
+    if read_only:
+        database_path = database_path.replace("sqlite:///", "sqlite:///file:", 1) \
+            + ("?mode=ro&immutable=1&uri=true" if immutable else "?mode=ro&uri=true")
+    new_engine = create_engine(database_path, pool_size=profile["pool_size"], max_overflow=profile["max_overflow"],
+                               query_cache_size=STATEMENT_CACHE_SIZE)
+    set_pragmas_on_connect(new_engine, profile["pragmas"], read_only)
+    set_query_timeout(new_engine, QUERY_TIMEOUT_MS)
+    return new_engine
 
-logging.basicConfig()
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
-engine = create_engine(DATABASE_PATH)
+profile = DATABASE_PROFILES[DATABASE_PROFILE]
+engine = create_profile_engine(DATABASE_PATH, profile)
 session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine))
+# Routes that only read use this session, with its own pool it never waits for the write connections.
+if profile["read_only_pool"]:
+    read_engine = create_profile_engine(DATABASE_PATH, profile, read_only=True)
+    read_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=read_engine))
+else:
+    read_engine = engine
+    read_session = session
 Base = declarative_base()
 Base.query = session.query_property()
 
@@ -0,0 +1,10 @@
+""" Async engine and session of the database, used when the API is served with asgi (see flask_api/asgi.py). """
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from flask_api.db.database import profile, set_pragmas_on_connect
+from settings import ASYNC_DATABASE_PATH, STATEMENT_CACHE_SIZE
+
+engine = create_async_engine(ASYNC_DATABASE_PATH, query_cache_size=STATEMENT_CACHE_SIZE)
+set_pragmas_on_connect(engine.sync_engine, profile["pragmas"])
+session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,95 @@
+"""
+Dictionary encoded columns. The distinct strings of a column are stored once, in a lookup table with an integer code per
+value, and the rows only store the codes. The conversion is done by sqlite in the statements: selected columns are
+decoded to the strings, compared values are encoded to the codes, so filters and 'GROUP BY' run on the integer codes.
+The lookup table of the column 'name' of the table 'Demandas' is 'Demandas_name'.
+"""
+
+from sqlalchemy import Table, Column, Integer, String, select, insert, type_coerce, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.dml import ValuesBase
+from sqlalchemy.types import TypeDecorator
+
+
+def create_lookup_table(metadata, table_name: str, column_name: str):
+    """ Lookup table with the 'code' and 'value' of the column 'column_name' of 'table_name'. """
+    return Table(f"{table_name}_{column_name}", metadata,
+                 Column("code", Integer, primary_key=True),
+                 Column("value", String, nullable=False, unique=True))
+
+
+class DictionaryEncoded(TypeDecorator):
+    """ String column stored as the integer code of the value in 'lookup_table'. """
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, lookup_table: Table):
+        super().__init__()
+        self.lookup_table = lookup_table
+
+    def bind_expression(self, bindvalue):
+        # values that are not in the lookup table are encoded as null, so they don't match any row.
+        lookup = self.lookup_table.c
+        return select(lookup.code).where(lookup.value == type_coerce(bindvalue, String)).scalar_subquery()
+
+    def column_expression(self, column):
+        lookup = self.lookup_table.c
+        return select(lookup.value).where(lookup.code == type_coerce(column, Integer)).scalar_subquery()
+
+    class comparator_factory(TypeDecorator.Comparator):
+        def operate(self, op, *other, **kwargs):
+            # 'IN' with a list of strings encodes them all in a single subquery.
+            if op in (operators.in_op, operators.not_in_op) and isinstance(other[0], (list, tuple, set)):
+                lookup = self.type.lookup_table.c
+                codes = select(lookup.code).where(lookup.value.in_(list(other[0])))
+                return op(type_coerce(self.expr, Integer), codes)
+            return super().operate(op, *other, **kwargs)
+
+
+def encoded_columns(table):
+    return [column for column in table.columns if isinstance(column.type, DictionaryEncoded)]
+
+
+def decoded(column):
+    """
+    Returns the decoded values of 'column' if it's encoded. Selects are decoded automatically, this is needed where
+    the selected columns are not the statement result, like in 'INSERT ... SELECT'.
+    """
+    if isinstance(column.type, DictionaryEncoded):
+        return column.type.column_expression(column).label(column.key)
+    return column
+
+
+def decode_sql(column, value_sql: str):
+    """ Sql expression decoding 'value_sql', the code of the encoded 'column', for statements written as text. """
+    return f"(SELECT value FROM {column.type.lookup_table.name} WHERE code = {value_sql})"
+
+
+@event.listens_for(Engine, "before_execute")
+def add_new_values(conn, clauseelement, multiparams, params, execution_options):
+    """
+    Add to the lookup tables the values written by inserts and updates of encoded columns that don't have a code yet,
+    in the same transaction, before the statement encodes them.
+    """
+    if not isinstance(clauseelement, ValuesBase):
+        return
+    columns = encoded_columns(clauseelement.table)
+    if not columns:
+        return
+
+    rows = list(multiparams) if multiparams else []
+    if params:
+        rows.append(params)
+    statement_values = {getattr(column, "key", column): value for column, value in clauseelement._values.items()} \
+        if clauseelement._values else {}
+    for column in columns:
+        # in the order they are written, so the codes follow the order of the rows.
+        values = dict.fromkeys(row[column.key] for row in rows
+                               if isinstance(row, dict) and row.get(column.key) is not None)
+        bound_value = getattr(statement_values.get(column.key), "value", None)
+        if bound_value is not None:
+            values[bound_value] = None
+        if values:
+            lookup = column.type.lookup_table
+            conn.execute(insert(lookup).prefix_with("OR IGNORE"), [{"value": value} for value in values])
@@ -0,0 +1,94 @@
+"""
+Group commit of the write routes. The writes are queued to a single writer thread, which applies the writes waiting in
+the queue in one transaction and commits them together, so a burst of writes pays for one commit (and one fsync)
+instead of one per request. A batch is committed GROUP_COMMIT_MAX_DELAY_MS after its first write or when it has
+GROUP_COMMIT_MAX_OPERATIONS writes, and every request waits until its batch is committed before responding.
+"""
+
+import logging
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+import flask_api.db.database as db
+from flask_api.cache import count_cache
+from settings import GROUP_COMMIT, GROUP_COMMIT_MAX_DELAY_MS, GROUP_COMMIT_MAX_OPERATIONS
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """ Writer thread applying and committing the submitted operations in batches. """
+    def __init__(self, enabled: bool, max_delay_ms: float, max_operations: int):
+        self.enabled = enabled
+        self.max_delay_ms = max_delay_ms
+        self.max_operations = max_operations
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = Lock()
+        self._batches = 0
+        self._operations = 0
+
+    def submit(self, operation):
+        """
+        Runs 'operation(session)' in the writer thread and returns its result after the batch it's in is committed.
+        The operation must not change the session if it returns an error response. Raises the operation exception.
+        """
+        self._start()
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"batches": self._batches, "operations": self._operations, "queued": self._queue.qsize()}
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="group-commit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay_ms / 1000
+            while len(batch) < self.max_operations:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.exception("Group commit failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                db.session.remove()
+
+    def _commit(self, batch):
+        """ Applies the operations of 'batch' in one transaction, or each in its own if any of them fails. """
+        try:
+            results = [operation(db.session) for operation, _ in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for item in batch:
+                    self._commit([item])
+            return
+
+        count_cache.clear()
+        with self._lock:
+            self._batches += 1
+            self._operations += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+writer = GroupCommitWriter(GROUP_COMMIT, GROUP_COMMIT_MAX_DELAY_MS, GROUP_COMMIT_MAX_OPERATIONS)
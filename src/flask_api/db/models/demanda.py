@@ -1,22 +1,46 @@
 import datetime
 import json
 
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped, mapped_column
 import flask_api.db.database as db
+from flask_api.db.dictionary import DictionaryEncoded, create_lookup_table
 from flask_api.db.models.serializer import Serializer
 
+# Low cardinality text columns, stored as codes of their lookup tables (see flask_api/db/dictionary.py).
+ENCODED_COLUMNS = ("razao_social", "classificacao_demanda", "natureza_demanda", "subtema_demanda")
+lookup_tables = {column: create_lookup_table(db.Base.metadata, "Demandas", column) for column in ENCODED_COLUMNS}
+
+
+def encoded_column(column, nullable=True):
+    return mapped_column(DictionaryEncoded(lookup_tables[column]), nullable=nullable)
+
 
 class Demanda(db.Base, Serializer):
     __tablename__ = "Demandas"
+    # Same indexes of db_utility/schema/demandas_indexes.sql, every column that can be filtered or grouped.
+    __table_args__ = (
+        # covers the narrow '?fields=demanda_id,ans,data_atendimento_demanda' queries filtered by ans.
+        Index("ix_demandas_ans_data_atendimento_demanda", "ans", "data_atendimento_demanda"),
+        Index("ix_demandas_razao_social", "razao_social"),
+        Index("ix_demandas_data_atendimento_demanda", "data_atendimento_demanda"),
+        Index("ix_demandas_classificacao_demanda", "classificacao_demanda"),
+        Index("ix_demandas_natureza_demanda", "natureza_demanda"),
+        Index("ix_demandas_subtema_demanda", "subtema_demanda"),
+        Index("ix_demandas_razao_social_classificacao_demanda", "razao_social", "classificacao_demanda"),
+        Index("ix_demandas_classificacao_demanda_natureza_demanda", "classificacao_demanda", "natureza_demanda"),
+        # date ranges of one operator, used by /demandas/count/timeseries.
+        Index("ix_demandas_razao_social_data_atendimento_demanda", "razao_social", "data_atendimento_demanda"),
+    )
 
     demanda_id: Mapped[int] = mapped_column(primary_key=True)
-    razao_social: Mapped[str] = mapped_column(nullable=False)
+    razao_social: Mapped[str] = encoded_column("razao_social", nullable=False)
     ans: Mapped[int] = mapped_column(nullable=True)
     beneficiarios: Mapped[int] = mapped_column(nullable=True)
     data_atendimento_demanda: Mapped[datetime.datetime] = mapped_column(nullable=True)
-    classificacao_demanda: Mapped[str] = mapped_column(nullable=True)
-    natureza_demanda: Mapped[str] = mapped_column(nullable=True)
-    subtema_demanda: Mapped[str] = mapped_column(nullable=True)
+    classificacao_demanda: Mapped[str] = encoded_column("classificacao_demanda")
+    natureza_demanda: Mapped[str] = encoded_column("natureza_demanda")
+    subtema_demanda: Mapped[str] = encoded_column("subtema_demanda")
 
     def __repr__(self):
         return f"<Demanda {self.demanda_id} - {self.ans} - {self.classificacao_demanda}>"
@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import inspect, Row
+from sqlalchemy import inspect, Row, DateTime
 
 
 def serialize(rows):
@@ -20,13 +20,62 @@ def serialize(rows):
         return [serialize(obj) for obj in rows]
 
 
+def _datetime_to_str(value):
+    # Datetime is not serializable.
+    return str(value) if isinstance(value, datetime.datetime) else value
+
+
 class Serializer(object):
+    @classmethod
+    def serialized_columns(cls):
+        """ Returns (key, converter) of the model attributes, computed once per model. """
+        if "_serialized_columns" not in cls.__dict__:
+            columns = []
+            for key, attr in inspect(cls).attrs.items():
+                is_datetime = any(isinstance(column.type, DateTime) for column in getattr(attr, "columns", []))
+                columns.append((key, _datetime_to_str if is_datetime else None))
+            cls._serialized_columns = columns
+        return cls._serialized_columns
+
+    @classmethod
+    def field_columns(cls, fields=None):
+        """ Returns (key, converter) of the attributes in 'fields', or of all of them. Raises ValueError if unknown. """
+        columns = cls.serialized_columns()
+        if fields is None:
+            return columns
+        converters = dict(columns)
+        unknown = [field for field in fields if field not in converters]
+        if unknown:
+            raise ValueError(f"unknown fields {unknown}, the fields are {list(converters)}")
+        return [(field, converters[field]) for field in fields]
+
+    @classmethod
+    def select_columns(cls, fields=None):
+        """
+        Columns to select rows that can be serialized with 'serialize_rows', without loading model objects.
+        'fields' selects only some of the attributes.
+        """
+        return [getattr(cls, key) for key, _ in cls.field_columns(fields)]
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None):
+        """ Serialize rows selected with the 'select_columns' of the model, with the same 'fields'. """
+        columns = cls.field_columns(fields)
+        keys = [key for key, _ in columns]
+        converters = [(i, converter) for i, (_, converter) in enumerate(columns) if converter is not None]
+        result = []
+        for row in rows:
+            values = list(row)
+            for i, converter in converters:
+                values[i] = converter(values[i])
+            # extra columns selected after the fields are not serialized.
+            result.append(dict(zip(keys, values)))
+        return result
+
     def serialize_obj(self):
         result = {}
-        for key in inspect(self).attrs.keys():
+        for key, converter in self.serialized_columns():
             result[key] = getattr(self, key)
-            if isinstance(result[key], datetime.datetime):
-                # Datetime is not serializable.
-                result[key] = str(result[key])
+            if converter is not None:
+                result[key] = converter(result[key])
         return result
-
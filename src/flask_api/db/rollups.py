@@ -0,0 +1,132 @@
+""" Rollup tables, with the count of demandas grouped by some columns, used to answer grouped counts quickly. """
+
+from collections import Counter
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index, func, select, insert, update, delete, inspect
+
+from flask_api.cache import count_cache
+from flask_api.db.dictionary import DictionaryEncoded, decoded
+from flask_api.db.models import Demanda
+
+# Rollup tables are not part of the models metadata, they only exist after being built by the data loader.
+metadata = MetaData()
+
+# Dimensions that are not columns of Demandas, they can't be requested in /demandas/count. The 'mes' rollup answers
+# the monthly /demandas/count/timeseries that are not grouped nor filtered.
+DERIVED_DIMENSIONS = {
+    "mes": (String(7), func.strftime("%Y-%m", Demanda.data_atendimento_demanda)),
+}
+
+
+def _month(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value[:7]
+    return value.strftime("%Y-%m")
+
+
+class Rollup:
+    """ Count of demandas grouped by 'dimensions', stored in the table 'Demandas_rollup_<name>'. """
+    def __init__(self, name: str, dimensions: tuple):
+        self.name = name
+        self.dimensions = dimensions
+        columns = [Column(dimension, self._dimension_type(dimension)) for dimension in dimensions]
+        self.table = Table(f"Demandas_rollup_{name}", metadata, *columns, Column("total", Integer, nullable=False))
+        Index(f"ix_demandas_rollup_{name}", *[self.table.c[dimension] for dimension in dimensions])
+
+    @staticmethod
+    def _dimension_type(dimension):
+        if dimension in DERIVED_DIMENSIONS:
+            return DERIVED_DIMENSIONS[dimension][0]
+        column_type = Demanda.__table__.c[dimension].type
+        # the rollup tables are small, they store the decoded values of the dictionary encoded columns.
+        return String if isinstance(column_type, DictionaryEncoded) else column_type
+
+    def covers(self, columns):
+        return set(columns) <= set(self.dimensions)
+
+    def build_query(self):
+        """ Select grouping the Demandas table by the rollup dimensions. """
+        expressions = []
+        group_expressions = []
+        for dimension in self.dimensions:
+            if dimension in DERIVED_DIMENSIONS:
+                expressions.append(DERIVED_DIMENSIONS[dimension][1].label(dimension))
+                group_expressions.append(expressions[-1])
+            else:
+                # grouped by the code of encoded columns, which is decoded once per group.
+                expressions.append(decoded(getattr(Demanda, dimension)))
+                group_expressions.append(getattr(Demanda, dimension))
+        return select(*expressions, func.count(Demanda.demanda_id)).group_by(*group_expressions)
+
+    def key(self, values):
+        """ Returns the dimension values of a row of Demandas, 'values' maps column names to values. """
+        return tuple(_month(values.get("data_atendimento_demanda")) if dimension == "mes" else values.get(dimension)
+                     for dimension in self.dimensions)
+
+
+ROLLUPS = [
+    Rollup("razao_social", ("razao_social",)),
+    Rollup("classificacao_demanda", ("classificacao_demanda",)),
+    Rollup("natureza_demanda", ("natureza_demanda",)),
+    Rollup("razao_social_classificacao_demanda", ("razao_social", "classificacao_demanda")),
+    Rollup("mes", ("mes",)),
+]
+
+_available = WeakKeyDictionary()
+
+
+def rollups_available(connection):
+    """
+    Returns whether the rollup tables were built in the database of 'connection'. It's checked again in every count
+    cache generation, so the rollups built (or dropped) by another process are seen after the data version changes.
+    """
+    engine = connection.engine
+    generation, available = _available.get(engine, (None, None))
+    if generation != count_cache.generation:
+        table_names = set(inspect(connection).get_table_names())
+        available = all(rollup.table.name in table_names for rollup in ROLLUPS)
+        _available[engine] = (count_cache.generation, available)
+    return available
+
+
+def build_rollups(connection):
+    """ Create (or recreate) all rollup tables with the counts of the current Demandas table. """
+    metadata.drop_all(connection)
+    metadata.create_all(connection)
+    for rollup in ROLLUPS:
+        columns = [*rollup.dimensions, "total"]
+        connection.execute(insert(rollup.table).from_select(columns, rollup.build_query()))
+    _available[connection.engine] = (count_cache.generation, True)
+
+
+def find_rollup(columns):
+    """ Returns the smallest rollup containing all 'columns', or None if no rollup covers them. """
+    candidates = [rollup for rollup in ROLLUPS if rollup.covers(columns)]
+    return min(candidates, key=lambda rollup: len(rollup.dimensions), default=None)
+
+
+def apply_changes(connection, rows, sign):
+    """
+    Add (sign=1) or remove (sign=-1) 'rows' from the rollup counts, 'rows' are mappings of column names to values.
+    This should run in the same transaction that changed the Demandas table.
+    """
+    if not rollups_available(connection):
+        return
+    for rollup in ROLLUPS:
+        changes = Counter(rollup.key(row) for row in rows)
+        for key, change in changes.items():
+            # 'IS' also matches null dimensions.
+            conditions = [rollup.table.c[dimension].is_(value) for dimension, value in zip(rollup.dimensions, key)]
+            query = update(rollup.table).where(*conditions).values(total=rollup.table.c.total + sign * change)
+            if connection.execute(query).rowcount == 0 and sign > 0:
+                connection.execute(insert(rollup.table).values(**dict(zip(rollup.dimensions, key)), total=change))
+        if sign < 0:
+            connection.execute(delete(rollup.table).where(rollup.table.c.total <= 0))
+
+
+def row_values(demanda):
+    """ Returns the column values of a Demanda object as a dict. """
+    return {column.key: getattr(demanda, column.key) for column in Demanda.__table__.columns}
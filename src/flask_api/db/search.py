@@ -0,0 +1,90 @@
+"""
+Full text search over the razao_social and subtema_demanda columns of Demandas, with a sqlite FTS5 table.
+The FTS table reads the decoded text of Demandas from a view (external content), it only stores the index, and
+triggers keep it in sync with every insert, update and delete of Demandas. The tokenizer removes the accents, so
+'saude' matches 'SAÚDE'.
+"""
+
+import re
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import inspect, select, table, column, text
+
+from flask_api.cache import count_cache
+from flask_api.db.dictionary import decode_sql
+from flask_api.db.models import Demanda
+
+SEARCH_TABLE = "Demandas_fts"
+SEARCH_COLUMNS = ("razao_social", "subtema_demanda")
+
+SEARCH_CONTENT_VIEW = "Demandas_search_content"
+
+
+def _decoded_values(prefix):
+    """ Sql of the decoded search columns of the row 'prefix' ('new', 'old' or the table name). """
+    return ", ".join(decode_sql(Demanda.__table__.c[name], f"{prefix}.{name}") for name in SEARCH_COLUMNS)
+
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_insert_new = f"INSERT INTO {SEARCH_TABLE}(rowid, {_columns}) VALUES (new.demanda_id, {_decoded_values('new')});"
+_delete_old = (f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {_columns}) "
+               f"VALUES ('delete', old.demanda_id, {_decoded_values('old')});")
+
+CREATE_STATEMENTS = [
+    # the columns are dictionary encoded, the FTS table reads the decoded text from this view.
+    f"CREATE VIEW {SEARCH_CONTENT_VIEW} (demanda_id, {_columns}) AS "
+    f"SELECT demanda_id, {_decoded_values('Demandas')} FROM Demandas",
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({_columns}, content='{SEARCH_CONTENT_VIEW}', "
+    f"content_rowid='demanda_id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON Demandas BEGIN {_insert_new} END",
+    f"CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON Demandas BEGIN {_delete_old} END",
+    f"CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF demanda_id, {_columns} ON Demandas "
+    f"BEGIN {_delete_old} {_insert_new} END",
+    # index the rows already in Demandas.
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+]
+
+# 'rank' is the bm25 score of the match, lower is better.
+search_table = table(SEARCH_TABLE, column("rowid"), column("rank"), column(SEARCH_TABLE))
+
+_available = WeakKeyDictionary()
+
+
+def search_available(connection):
+    """ Returns whether the search table was built in the database of 'connection', checked like rollups_available. """
+    engine = connection.engine
+    generation, available = _available.get(engine, (None, None))
+    if generation != count_cache.generation:
+        available = SEARCH_TABLE in inspect(connection).get_table_names()
+        _available[engine] = (count_cache.generation, available)
+    return available
+
+
+def build_search_index(connection):
+    """ Create (or recreate) the search table and its triggers, indexing the current Demandas table. """
+    for trigger in ("insert", "delete", "update"):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{trigger}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+    connection.execute(text(f"DROP VIEW IF EXISTS {SEARCH_CONTENT_VIEW}"))
+    for statement in CREATE_STATEMENTS:
+        connection.execute(text(statement))
+    _available[connection.engine] = (count_cache.generation, True)
+
+
+def create_match_expression(search_text: str):
+    """
+    Returns the FTS5 query matching all words of 'search_text' as prefixes. The words are quoted, so the text can't
+    use the FTS5 query syntax. Raises ValueError if there is no word in the text.
+    """
+    words = re.findall(r"\w+", search_text)
+    if not words:
+        raise ValueError("q must contain at least one word")
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def create_search_query(search_text: str):
+    """ Query of the demandas matching 'search_text', best matches first. """
+    return (select(*Demanda.select_columns())
+            .join(search_table, search_table.c.rowid == Demanda.demanda_id)
+            .where(search_table.c[SEARCH_TABLE].op("MATCH")(create_match_expression(search_text)))
+            .order_by(search_table.c.rank, Demanda.demanda_id))
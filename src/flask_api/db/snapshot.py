@@ -0,0 +1,103 @@
+"""
+Read only snapshot serving mode. The data loader publishes a compacted copy of the database (VACUUM INTO, with the
+ANALYZE statistics) to SNAPSHOT_PATH, replacing the previous snapshot with a rename, so a snapshot file is never
+changed once published. The API opens it read only and immutable (sqlite skips the locks and the change checks),
+memory mapped only when SNAPSHOT_MMAP_SIZE is set, doesn't create the schema and refuses the write routes.
+
+Every SNAPSHOT_CHECK_SECONDS a request checks if the file at SNAPSHOT_PATH was replaced. A new snapshot gets a new
+engine, the requests already running keep the connections (and the open file) of the previous one.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from threading import Lock
+
+import flask_api.db.database as db
+from flask_api.cache import count_cache
+from settings import DATABASE_PROFILES, DATABASE_PROFILE, SNAPSHOT_CHECK_SECONDS, SNAPSHOT_MMAP_SIZE, SNAPSHOT_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def publish_snapshot(engine, path):
+    """ Writes a compacted copy of the database of 'engine' to 'path', replacing the previous snapshot atomically. """
+    temporary_path = f"{path}.tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    with engine.connect() as connection:
+        # VACUUM can't run in a transaction.
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("VACUUM INTO ?", (temporary_path,))
+    with closing(sqlite3.connect(temporary_path)) as connection:
+        # a snapshot in WAL mode would need the -wal and -shm files to be read.
+        connection.execute("PRAGMA journal_mode = DELETE")
+    with open(temporary_path, "rb+") as snapshot_file:
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+    logger.info("Published snapshot %s (%.1f MB)", path, os.path.getsize(path) / 1024 / 1024)
+
+
+def file_id(path):
+    """ Identifies the file at 'path', a published snapshot is a new file. """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class SnapshotDatabase:
+    """ The snapshot served from 'path', disabled when 'path' is None. """
+    def __init__(self, path, check_seconds: float):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.file_id = None
+        self._next_check = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def open(self):
+        """ Opens the current snapshot file and makes the sessions use it. """
+        with self._lock:
+            self._open()
+
+    def check(self):
+        """ Opens the snapshot file if it was replaced since it was opened, at most every 'check_seconds'. """
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_seconds
+        try:
+            changed = file_id(self.path) != self.file_id
+        except FileNotFoundError:
+            # between a delete and a new publish the current snapshot is still served.
+            return
+        if changed:
+            with self._lock:
+                if file_id(self.path) != self.file_id:
+                    self._open()
+
+    def _open(self):
+        current_id = file_id(self.path)
+        profile = DATABASE_PROFILES[DATABASE_PROFILE]
+        pragmas = {**profile["pragmas"], "mmap_size": SNAPSHOT_MMAP_SIZE}
+        engine = db.create_profile_engine(f"sqlite:///{self.path}", {**profile, "pragmas": pragmas},
+                                          read_only=True, immutable=True)
+        previous_engine = db.engine
+        # the sessions already created keep the previous engine, the new ones use the snapshot.
+        db.engine = db.read_engine = engine
+        db.session.configure(bind=engine)
+        db.read_session = db.session
+        self.file_id = current_id
+        # the cached counts and the column store are from the previous snapshot.
+        count_cache.clear()
+        # the connections in use are closed when they are returned.
+        previous_engine.dispose()
+        logger.info("Serving snapshot %s", self.path)
+
+
+snapshot = SnapshotDatabase(SNAPSHOT_PATH, SNAPSHOT_CHECK_SECONDS)
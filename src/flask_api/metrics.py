@@ -0,0 +1,156 @@
+"""
+Per request instrumentation. Engine events count the queries and time their execution, the routes time the
+serialization and the app times the whole handler. The timings of a request are sent in its 'Server-Timing' header
+and aggregated in histograms per endpoint, returned by the /metrics route. Queries slower than SLOW_QUERY_MS are logged.
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import SLOW_QUERY_MS, METRICS_BUCKETS_MS
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    """ Number of queries and milliseconds spent in sql, serialization and in total by one request. """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.serialize_ms = 0.0
+        self.total_ms = None
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """ Value of the 'Server-Timing' header. """
+        return (f'sql;dur={self.sql_ms:.2f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serialize_ms:.2f}, total;dur={self.total_ms:.2f}')
+
+
+class Histogram:
+    """ Cumulative histogram of values in milliseconds, safe to use from multiple threads. """
+    def __init__(self, buckets=METRICS_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self):
+        """ Returns the count, sum and the cumulative count of values less or equal to each bucket. """
+        with self._lock:
+            counts = list(self._counts)
+            result = {"count": self._count, "sum": self._sum, "buckets": {}}
+        cumulative = 0
+        for bucket, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative += count
+            result["buckets"][str(bucket)] = cumulative
+        return result
+
+
+class Metrics:
+    """ Histograms of the request timings, grouped by endpoint. """
+    NAMES = ("queries", "sql_ms", "serialize_ms", "total_ms")
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = Lock()
+
+    def record(self, endpoint, timings: RequestTimings):
+        with self._lock:
+            histograms = self._endpoints.get(endpoint)
+            if histograms is None:
+                histograms = self._endpoints[endpoint] = {name: Histogram() for name in self.NAMES}
+        for name in self.NAMES:
+            histograms[name].observe(getattr(timings, name))
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {endpoint: {name: histogram.snapshot() for name, histogram in histograms.items()}
+                for endpoint, histograms in endpoints.items()}
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+metrics = Metrics()
+current_timings: ContextVar = ContextVar("current_timings", default=None)
+
+
+def start_request():
+    current_timings.set(RequestTimings())
+
+
+def finish_request(response, endpoint):
+    """ Adds the 'Server-Timing' header to 'response' and records the timings of the request. """
+    server_timing = record_request(endpoint)
+    if server_timing is not None:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+
+def record_request(endpoint):
+    """ Records the timings of the current request, returns its 'Server-Timing' header, None outside a request. """
+    timings = current_timings.get()
+    if timings is None:
+        return None
+    timings.finish()
+    metrics.record(endpoint or "unknown", timings)
+    return timings.server_timing()
+
+
+def end_request():
+    current_timings.set(None)
+
+
+@contextmanager
+def timed_serialization():
+    """ Adds the time spent in the block to the serialization time of the current request. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.serialize_ms += (time.perf_counter() - start) * 1000
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+    timings = current_timings.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.sql_ms += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.2f ms): %s", elapsed_ms, statement)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(exception_context):
+    # the failed statement doesn't reach after_cursor_execute.
+    if exception_context.connection is not None and exception_context.connection.info.get("query_start"):
+        exception_context.connection.info["query_start"].pop()
@@ -2,47 +2,355 @@
 
 from datetime import datetime
 
-from flask import request, Response, Blueprint
-from sqlalchemy import select, func, inspect, delete
+from flask import request, Response, Blueprint, current_app, stream_with_context
+from sqlalchemy import select, func, delete
 
+from flask_api.cache import count_cache
+from flask_api.db import group_commit, rollups, search
+from flask_api.db.column_store import column_store
+from flask_api.db.dictionary import decoded
 from flask_api.db.models import Demanda
 import flask_api.db.database as db
 from flask_api.db.models.serializer import serialize
-from flask_api.utils import create_filtered_query, create_group_by_query
+from flask_api.metrics import timed_serialization
+from flask_api.utils import create_filtered_query, create_group_by_query, create_query_key, get_filter_columns, \
+    get_group_columns, explain_query_plan, parse_date_range, create_date_range_query, get_column, limit_rows, \
+    check_row_limit
+from settings import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, STREAM_BATCH_SIZE
 
 demandas_bp = Blueprint('demandas', __name__)
 
+# Expressions of the '?bucket=' of /demandas/count/timeseries, weeks are named by their monday.
+TIME_BUCKETS = {
+    "day": lambda column: func.date(column),
+    "week": lambda column: func.date(column, "weekday 0", "-6 days"),
+    "month": lambda column: func.strftime("%Y-%m", column),
+    "year": lambda column: func.strftime("%Y", column),
+}
+
 
 @demandas_bp.route('/demandas')
 def demandas():
-    """ Returns all Demandas sorted by id. This query can be filtered with '?filter_column=value' """
-    query = select(Demanda)
-    query = create_filtered_query(query, Demanda)
+    """
+    Returns all Demandas sorted by id. This query can be filtered with '?filter_column=value'.
+    Use '?limit=N&after=id' for keyset pagination or '?stream=true' to stream the whole result in batches.
+    '?fields=column(s)' returns only those columns, only they are read from the database.
+    """
+    try:
+        fields = parse_fields(request.args)
+    except ValueError as e:
+        return Response(f"Invalid request: {e}.", status=400)
+    query = create_demandas_query(fields=fields)
+
+    if request.args.get("stream", "").lower() == "true":
+        return Response(stream_with_context(stream_demandas(query, fields)), mimetype="application/json")
+
+    if "limit" in request.args or "after" in request.args:
+        try:
+            after, limit = parse_page_args(request.args)
+        except ValueError as e:
+            return Response(f"Invalid request: {e}.", status=400)
+        return paginate_demandas(query, after, limit, fields)
+
+    result = check_row_limit(db.read_session.execute(limit_rows(query)).all())
+
+    with timed_serialization():
+        return current_app.json.response(Demanda.serialize_rows(result, fields))
+
+
+def create_demandas_query(args=None, fields=None):
+    """ Query of the filtered demandas sorted by id, selecting only the columns in 'fields' if given. """
+    # plain rows are faster to fetch and serialize than model objects.
+    columns = Demanda.select_columns(fields)
+    if fields is not None and "demanda_id" not in fields:
+        # the id is the cursor of the pagination, it's selected but not serialized.
+        columns.append(Demanda.demanda_id)
+    query = select(*columns).order_by(Demanda.demanda_id)
+    return create_filtered_query(query, Demanda, args)
 
-    result = db.session.execute(query).all()
 
-    return serialize(result)
+def parse_fields(args):
+    """ Returns the columns in '?fields=', None if not given. Raises ValueError if a column is not a Demanda column. """
+    fields = args.get("fields")
+    if not fields:
+        return None
+    fields = list(dict.fromkeys(fields.split(",")))
+    Demanda.field_columns(fields)
+    return fields
+
+
+def parse_page_args(args):
+    """ Returns the 'after' and 'limit' pagination arguments, raises ValueError if they are invalid. """
+    limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+    after = args.get("after")
+    after = int(after) if after is not None else None
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+    return after, limit
+
+
+def create_page_query(query, after, limit):
+    """ Query of the page after the 'after' id, with one extra row to know if there is a next page. """
+    if after is not None:
+        query = query.where(Demanda.demanda_id > after)
+    return query.limit(limit + 1)
+
+
+def create_page(result, limit, fields=None):
+    """ Returns the page items and the cursor of the next page, from the result of the page query. """
+    next_cursor = result[limit - 1].demanda_id if len(result) > limit else None
+    return {"items": Demanda.serialize_rows(result[:limit], fields), "next_cursor": next_cursor}
+
+
+def paginate_demandas(query, after, limit, fields=None):
+    """ Returns one page of demandas after the 'after' id and the cursor of the next page. """
+    result = db.read_session.execute(create_page_query(query, after, limit)).all()
+    with timed_serialization():
+        return current_app.json.response(create_page(result, limit, fields))
+
+
+def stream_demandas(query, fields=None):
+    """ Yields the query result as a json array, fetching rows in batches from a server side cursor. """
+    result = db.read_session.execute(query.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE))
+    separator = "["
+    for partition in result.partitions():
+        # encode the whole batch at once and remove its brackets.
+        yield separator + current_app.json.dumps(Demanda.serialize_rows(partition, fields))[1:-1]
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+@demandas_bp.route('/demandas/search')
+def demandas_search():
+    """
+    Full text search of '?q=words' in the operator name and subtema, ignoring accents and case, best matches first.
+    The result can be filtered with '?filter_column=value' and is paginated with '?limit=N&offset=M'.
+    """
+    if not search.search_available(db.read_session.connection()):
+        return Response("The search index wasn't built, run the data loader.", status=503)
+    try:
+        offset, limit = parse_search_args(request.args)
+        query = create_filtered_query(search.create_search_query(request.args.get("q", "")), Demanda)
+    except ValueError as e:
+        return Response(f"Invalid request: {e}.", status=400)
+
+    result = db.read_session.execute(query.offset(offset).limit(limit + 1)).all()
+    with timed_serialization():
+        next_offset = offset + limit if len(result) > limit else None
+        return current_app.json.response({"items": Demanda.serialize_rows(result[:limit]), "next_offset": next_offset})
+
+
+def parse_search_args(args):
+    """ Returns the 'offset' and 'limit' arguments of the search, raises ValueError if they are invalid. """
+    limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+    offset = int(args.get("offset", 0))
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    return offset, limit
 
 
 @demandas_bp.route('/demandas/count')
 def demandas_count():
     """
     Returns the count of all demandas. The query can also specify grouping with '?group_by=column(s)' and be filtered.
+    Results are cached until the next write, the 'X-Cache' header tells if the response was a cache HIT or MISS.
+    When the grouped and filtered columns are covered by a rollup table the count is read from it, otherwise from the
+    column store when it's enabled and loaded.
     """
-    group_columns = request.args.get("group_by")
-    group_columns = group_columns.split(',') if group_columns is not None else []
-    select_columns = [func.count(Demanda.demanda_id).label("total")]
+    cache_key = create_query_key()
+    cached_result = count_cache.get(cache_key)
+    if cached_result is not None:
+        return cached_result, {"X-Cache": "HIT"}
+    generation = count_cache.generation
+
+    group_columns = get_group_columns()
+    rollup = find_count_rollup(db.read_session.connection(), group_columns)
+    if rollup is None and column_store.enabled:
+        result = count_from_column_store(group_columns)
+        if result is not None:
+            check_row_limit(result)
+            count_cache.set(cache_key, result, generation)
+            return result, {"X-Cache": "MISS"}
+    query = create_count_query(group_columns, rollup)
+
+    rows = check_row_limit(db.read_session.execute(limit_rows(query)).all())
+    with timed_serialization():
+        result = serialize(rows)
+    count_cache.set(cache_key, result, generation)
+    return result, {"X-Cache": "MISS"}
+
+
+def find_count_rollup(connection, group_columns, args=None):
+    """ Returns the rollup that can answer the count grouped by 'group_columns' and filtered by 'args', if any. """
+    columns = group_columns + get_filter_columns(args)
+    # the derived dimensions are not columns of Demandas, they are only used by the timeseries.
+    if not rollups.rollups_available(connection) or any(column in rollups.DERIVED_DIMENSIONS for column in columns):
+        return None
+    return rollups.find_rollup(columns)
+
+
+def count_from_column_store(group_columns, args=None):
+    """ Returns the count from the column store, None if it isn't loaded yet or can't answer the query. """
+    snapshot = column_store.current(db.read_session.get_bind())
+    if snapshot is None:
+        return None
+    args = request.args if args is None else args
+    return snapshot.count(group_columns, {column: args[column].split(',') for column in get_filter_columns(args)})
+
+
+def create_count_query(group_columns, rollup=None, args=None):
+    """
+    Query counting demandas grouped by 'group_columns', from the 'rollup' table when given. The groups are sorted by
+    the group values, the encoded columns by their decoded text, so the rollup tables, the base table and the column
+    store return the groups in the same order.
+    """
+    if rollup is not None:
+        source = rollup.table.c
+        select_columns = [func.coalesce(func.sum(source.total), 0).label("total")]
+    else:
+        source = Demanda
+        select_columns = [func.count(Demanda.demanda_id).label("total")]
     for column in group_columns:
-        column_obj = getattr(Demanda, column)
-        if column_obj is not None:
-            select_columns.append(column_obj)
+        select_columns.append(get_column(source, column))
 
     query = select(*select_columns)
-    query = create_group_by_query(query, select_columns[1:])
-    query = create_filtered_query(query, Demanda)
+    query = create_group_by_query(query, select_columns[1:]).order_by(*map(decoded, select_columns[1:]))
+    return create_filtered_query(query, source, args)
+
+
+@demandas_bp.route('/demandas/count/timeseries')
+def demandas_count_timeseries():
+    """
+    Returns the count of demandas per '?bucket=day|week|month|year' of data_atendimento_demanda, sorted by bucket.
+    It can be limited to '?from=YYYY-MM-DD&to=YYYY-MM-DD' (inclusive), grouped by '?group_by=column(s)' and filtered.
+    Results are cached like /demandas/count.
+    """
+    try:
+        bucket, start, end = parse_timeseries_args(request.args)
+    except ValueError as e:
+        return Response(f"Invalid request: {e}.", status=400)
+
+    cache_key = ("timeseries", bucket, start, end, create_query_key())
+    cached_result = count_cache.get(cache_key)
+    if cached_result is not None:
+        return cached_result, {"X-Cache": "HIT"}
+    generation = count_cache.generation
+
+    group_columns = get_group_columns()
+    rollup = find_timeseries_rollup(db.read_session.connection(), bucket, group_columns, start, end)
+    query = create_timeseries_query(bucket, group_columns, start, end, rollup=rollup)
+    rows = check_row_limit(db.read_session.execute(limit_rows(query)).all())
+    with timed_serialization():
+        result = [row._asdict() for row in rows]
+    count_cache.set(cache_key, result, generation)
+    return result, {"X-Cache": "MISS"}
+
+
+def parse_timeseries_args(args):
+    """ Returns the bucket and the date range of the timeseries, raises ValueError if they are invalid. """
+    bucket = args.get("bucket", "month")
+    if bucket not in TIME_BUCKETS:
+        raise ValueError(f"bucket must be one of {tuple(TIME_BUCKETS)}")
+    return (bucket, *parse_date_range(args))
+
+
+def find_timeseries_rollup(connection, bucket, group_columns, start, end, args=None):
+    """
+    Returns the month rollup when it can answer the timeseries: monthly buckets, not grouped nor filtered, and a date
+    range of whole months.
+    """
+    if bucket != "month" or group_columns or get_filter_columns(args) or not rollups.rollups_available(connection):
+        return None
+    # the range end is exclusive, a range of whole months starts and ends on the first day of a month.
+    if any(date is not None and date.day != 1 for date in (start, end)):
+        return None
+    return rollups.find_rollup(["mes"])
+
+
+def create_timeseries_query(bucket, group_columns, start=None, end=None, args=None, rollup=None):
+    """
+    Query counting demandas per time 'bucket' and 'group_columns', in the [start, end) range. From the month 'rollup'
+    when given, see find_timeseries_rollup.
+    """
+    if rollup is not None:
+        month = rollup.table.c.mes
+        query = select(month.label("bucket"), rollup.table.c.total).where(month.is_not(None))
+        if start is not None:
+            query = query.where(month >= start.strftime("%Y-%m"))
+        if end is not None:
+            query = query.where(month < end.strftime("%Y-%m"))
+        return query.order_by(month)
+
+    date_column = Demanda.data_atendimento_demanda
+    bucket_column = TIME_BUCKETS[bucket](date_column).label("bucket")
+    group_objs = [get_column(Demanda, column) for column in group_columns]
 
-    result = db.session.execute(query).all()
-    return serialize(result)
+    query = select(bucket_column, *group_objs, func.count(Demanda.demanda_id).label("total")) \
+        .where(date_column.is_not(None))
+    query = create_date_range_query(query, date_column, start, end)
+    query = create_group_by_query(query, [bucket_column, *group_objs]) \
+        .order_by(bucket_column, *map(decoded, group_objs))
+    return create_filtered_query(query, Demanda, args)
+
+
+@demandas_bp.route('/demandas/explain/<route>')
+def demandas_explain(route):
+    """
+    Returns the sqlite query plan of the query done by '/demandas' (route 'demandas'), '/demandas/count' (route
+    'count') or '/demandas/count/timeseries' (route 'timeseries') with the same query string, listing the steps that
+    scan the whole table.
+    """
+    if route == "demandas":
+        try:
+            query = create_demandas_query(fields=parse_fields(request.args))
+        except ValueError as e:
+            return Response(f"Invalid request: {e}.", status=400)
+        if "limit" in request.args or "after" in request.args:
+            try:
+                query = create_page_query(query, *parse_page_args(request.args))
+            except ValueError as e:
+                return Response(f"Invalid request: {e}.", status=400)
+    elif route == "count":
+        group_columns = get_group_columns()
+        query = create_count_query(group_columns, find_count_rollup(db.read_session.connection(), group_columns))
+    elif route == "timeseries":
+        try:
+            bucket, start, end = parse_timeseries_args(request.args)
+        except ValueError as e:
+            return Response(f"Invalid request: {e}.", status=400)
+        group_columns = get_group_columns()
+        rollup = find_timeseries_rollup(db.read_session.connection(), bucket, group_columns, start, end)
+        query = create_timeseries_query(bucket, group_columns, start, end, rollup=rollup)
+    else:
+        return Response(f"Unknown route: {route}", status=404)
+    return explain_query_plan(db.read_session, query)
+
+
+@demandas_bp.route('/demandas/count/cache')
+def demandas_count_cache():
+    """ Returns the statistics of the /demandas/count cache. """
+    return count_cache.stats()
+
+
+def commit_changes():
+    """ Commit the session and invalidate the cached results that depend on the table. """
+    db.session.commit()
+    count_cache.clear()
+
+
+def run_write(operation):
+    """
+    Runs 'operation(session)', which changes the table and returns the response of the route, and commits it unless
+    the response is an error. With group commit enabled it's committed by the writer thread together with other writes.
+    """
+    if group_commit.writer.enabled:
+        return group_commit.writer.submit(operation)
+    response = operation(db.session)
+    if response.status_code < 400:
+        commit_changes()
+    return response
 
 
 @demandas_bp.route('/demandas/add', methods=['POST'])
@@ -53,55 +361,68 @@ def demandas_create_new():
         data_atendimento_demanda = data.get("data_atendimento_demanda")
         if data_atendimento_demanda is not None:
             data_atendimento_demanda = datetime.strptime(data_atendimento_demanda, "%Y-%m-%d %H:%M:%S")
-        new_demanda = Demanda(ans=data['ans'],
-                              razao_social=data['razao_social'],
-                              beneficiarios=data.get("beneficiarios"),
-                              data_atendimento_demanda=data_atendimento_demanda,
-                              classificacao_demanda=data.get("classificacao_demanda"),
-                              natureza_demanda=data.get("natureza_demanda"),
-                              subtema_demanda=data.get("subtema_demanda"))
-        db.session.add(new_demanda)
+        values = dict(ans=data['ans'],
+                      razao_social=data['razao_social'],
+                      beneficiarios=data.get("beneficiarios"),
+                      data_atendimento_demanda=data_atendimento_demanda,
+                      classificacao_demanda=data.get("classificacao_demanda"),
+                      natureza_demanda=data.get("natureza_demanda"),
+                      subtema_demanda=data.get("subtema_demanda"))
     except KeyError as e:
         return Response(f"Missing required field: {e.args}.", status=400)
     except Exception as e:
         return Response(f"Invalid request: {e}.", status=400)
 
-    db.session.commit()
-    return Response("Item created successfully.", status=201)
+    def add(session):
+        new_demanda = Demanda(**values)
+        session.add(new_demanda)
+        rollups.apply_changes(session.connection(), [rollups.row_values(new_demanda)], 1)
+        return Response("Item created successfully.", status=201)
+
+    return run_write(add)
 
 
 @demandas_bp.route('/demandas/update/<int:demanda_id>', methods=['PUT'])
 def demandas_update(demanda_id):
     """ Update a Demanda with 'id'. """
     data = request.form
-
-    query = select(Demanda).where(Demanda.demanda_id == demanda_id)
-    demanda_to_update = db.session.execute(query).first()
-    if demanda_to_update is None:
-        return Response(f"Couldn't find object with id: {demanda_id}", status=404)
-    else:
-        demanda_to_update = demanda_to_update[0]
-
-    for key in inspect(demanda_to_update).attrs.keys():
+    # parsed before changing the demanda, so an invalid value doesn't leave it half updated.
+    new_values = {}
+    for key, _ in Demanda.serialized_columns():
         new_value = data.get(key)
         if new_value is not None:
             try:
                 if key == 'data_atendimento_demanda':
                     new_value = datetime.strptime(new_value, "%Y-%m-%d %H:%M:%S")
-                setattr(demanda_to_update, key, new_value)
             except Exception as e:
                 return Response(f"Invalid request: {e}.", status=400)
-    db.session.commit()
-    return "Item updated successfully."
+            new_values[key] = new_value
+
+    def update(session):
+        query = select(Demanda).where(Demanda.demanda_id == demanda_id)
+        demanda_to_update = session.execute(query).scalar()
+        if demanda_to_update is None:
+            return Response(f"Couldn't find object with id: {demanda_id}", status=404)
+        old_values = rollups.row_values(demanda_to_update)
+
+        for key, new_value in new_values.items():
+            setattr(demanda_to_update, key, new_value)
+        rollups.apply_changes(session.connection(), [old_values], -1)
+        rollups.apply_changes(session.connection(), [rollups.row_values(demanda_to_update)], 1)
+        return Response("Item updated successfully.")
+
+    return run_write(update)
 
 
 @demandas_bp.route('/demandas/delete/<int:demanda_id>', methods=["DELETE"])
 def demanda_delete(demanda_id):
     """ Deletes a row containing 'demanda_id'."""
-    query = delete(Demanda).where(Demanda.demanda_id == demanda_id)
-    result = db.session.execute(query)
-    db.session.commit()
+    def delete_demanda(session):
+        query = delete(Demanda).where(Demanda.demanda_id == demanda_id).returning(*Demanda.__table__.columns)
+        deleted_rows = session.execute(query).mappings().all()
+        if len(deleted_rows) == 0:
+            return Response(f"Couldn't find object with id: {demanda_id}", status=404)
+        rollups.apply_changes(session.connection(), deleted_rows, -1)
+        return Response("Item deleted successfully.")
 
-    if result.rowcount == 0:
-        return Response(f"Couldn't find object with id: {demanda_id}", status=404)
-    return "Item deleted successfully."
\ No newline at end of file
+    return run_write(delete_demanda)
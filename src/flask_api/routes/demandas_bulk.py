@@ -0,0 +1,219 @@
+"""
+Routes to add, update and delete many rows of the 'Demandas' table in a single request and transaction.
+The body is a json array or, with the 'application/x-ndjson' content type, one json object per line.
+With '?mode=atomic' (default) nothing is changed if any item is invalid, with '?mode=best_effort' the valid items are
+applied and the invalid ones are reported. The response has one result per item, in the same order of the body.
+"""
+
+import json
+from datetime import datetime
+
+from flask import request, Response, Blueprint
+from sqlalchemy import select, insert, update, delete
+
+from flask_api.db import rollups
+from flask_api.db.models import Demanda
+import flask_api.db.database as db
+from flask_api.routes.demandas import commit_changes
+
+demandas_bulk_bp = Blueprint('demandas_bulk', __name__)
+
+BULK_MODES = ("atomic", "best_effort")
+INTEGER_COLUMNS = ("demanda_id", "ans", "beneficiarios")
+REQUIRED_COLUMNS = ("ans", "razao_social")
+# Maximum number of ids in a single 'IN' clause.
+IDS_PER_QUERY = 5000
+
+
+class InvalidItem(Exception):
+    """ An item of the body that can't be applied, 'status' is the http status code of its result. """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_body():
+    """ Returns the list of items in the request body, raises ValueError if the body is not valid. """
+    if request.mimetype == "application/x-ndjson":
+        return [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    items = json.loads(request.get_data(as_text=True))
+    if not isinstance(items, list):
+        raise ValueError("the body must be a json array")
+    return items
+
+
+def parse_demanda(item, partial=False):
+    """
+    Returns the column values of a demanda in 'item'. Unless 'partial', the required columns must be present and the
+    missing ones are set to None.
+    """
+    if not isinstance(item, dict):
+        raise InvalidItem("Item must be a json object.")
+    unknown_columns = set(item) - set(Demanda.__table__.columns.keys())
+    if unknown_columns:
+        raise InvalidItem(f"Unknown fields: {sorted(unknown_columns)}.")
+    missing_columns = [] if partial else [column for column in REQUIRED_COLUMNS if item.get(column) is None]
+    if missing_columns:
+        raise InvalidItem(f"Missing required field: {tuple(missing_columns)}.")
+
+    values = {} if partial else {column: None for column in Demanda.__table__.columns.keys()}
+    for column, value in item.items():
+        try:
+            if value is not None and column in INTEGER_COLUMNS:
+                value = int(value)
+            elif value is not None and column == "data_atendimento_demanda":
+                value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError) as e:
+            raise InvalidItem(f"Invalid request: {e}.")
+        values[column] = value
+    return values
+
+
+def parse_id(item):
+    """ Returns the demanda_id of an item, that can be the id itself or an object containing it. """
+    demanda_id = item.get("demanda_id") if isinstance(item, dict) else item
+    if isinstance(demanda_id, bool) or not isinstance(demanda_id, int):
+        raise InvalidItem("Item must have an integer 'demanda_id'.")
+    return demanda_id
+
+
+def select_existing(ids):
+    """ Returns a dict of id to the values of the existing demandas with 'ids'. """
+    ids = list(ids)
+    existing = {}
+    for i in range(0, len(ids), IDS_PER_QUERY):
+        query = select(*Demanda.__table__.columns).where(Demanda.demanda_id.in_(ids[i:i + IDS_PER_QUERY]))
+        existing.update((row.demanda_id, row._asdict()) for row in db.session.execute(query))
+    return existing
+
+
+def find_duplicated_ids(valid_items, get_id):
+    """ Returns InvalidItem errors for the items repeating the id of a previous item. """
+    errors = {}
+    seen_ids = set()
+    for index, item in valid_items.items():
+        demanda_id = get_id(item)
+        if demanda_id is None:
+            continue
+        if demanda_id in seen_ids:
+            errors[index] = InvalidItem(f"Duplicated id: {demanda_id}", status=409)
+        seen_ids.add(demanda_id)
+    return errors
+
+
+def run_bulk(parse_item, check_items, apply_items, success_status):
+    """
+    Parse every item of the body with 'parse_item(item)' and check the parsed items against the database with
+    'check_items(valid_items)', both report invalid items with InvalidItem errors. The remaining items are changed with
+    'apply_items(valid_items)', which can return extra result fields per item, and committed at once.
+    'valid_items' is always a dict of the item index in the body to its parsed value.
+    """
+    mode = request.args.get("mode", "atomic")
+    if mode not in BULK_MODES:
+        return Response(f"Invalid request: mode must be one of {BULK_MODES}.", status=400)
+    try:
+        items = parse_body()
+    except ValueError as e:
+        return Response(f"Invalid request: {e}.", status=400)
+
+    results = [{"index": index, "status": success_status} for index in range(len(items))]
+    errors = {}
+    valid_items = {}
+    for index, item in enumerate(items):
+        try:
+            valid_items[index] = parse_item(item)
+        except InvalidItem as e:
+            errors[index] = e
+    errors.update(check_items(valid_items))
+
+    for index, error in errors.items():
+        results[index].update(status=error.status, message=str(error))
+        valid_items.pop(index, None)
+
+    if mode == "atomic" and errors:
+        for index in valid_items:
+            results[index].update(status=424, message="Not applied, other items are invalid.")
+        return {"applied": 0, "results": results}, 400
+
+    if valid_items:
+        for index, result in apply_items(valid_items).items():
+            results[index].update(result)
+        commit_changes()
+    return {"applied": len(valid_items), "results": results}
+
+
+@demandas_bulk_bp.route('/demandas/bulk/add', methods=['POST'])
+def demandas_bulk_create():
+    """ Add many demandas. The id is generated unless 'demanda_id' is given, in which case it must not exist yet. """
+    def check_items(valid_items):
+        errors = find_duplicated_ids(valid_items, lambda values: values["demanda_id"])
+        existing_ids = select_existing(values["demanda_id"] for values in valid_items.values()
+                                       if values["demanda_id"] is not None)
+        for index, values in valid_items.items():
+            if values["demanda_id"] in existing_ids:
+                errors[index] = InvalidItem(f"Object with id {values['demanda_id']} already exists", status=409)
+        return errors
+
+    def apply_items(valid_items):
+        query = insert(Demanda).returning(Demanda.demanda_id, sort_by_parameter_order=True)
+        created_ids = db.session.execute(query, list(valid_items.values())).scalars().all()
+        rollups.apply_changes(db.session.connection(), list(valid_items.values()), 1)
+        return {index: {"demanda_id": demanda_id} for index, demanda_id in zip(valid_items, created_ids)}
+
+    return run_bulk(parse_demanda, check_items, apply_items, 201)
+
+
+@demandas_bulk_bp.route('/demandas/bulk/update', methods=['PUT'])
+def demandas_bulk_update():
+    """ Update many demandas, each item has the 'demanda_id' to update and the new values of its fields. """
+    old_rows = {}
+
+    def parse_item(item):
+        parse_id(item)
+        values = parse_demanda(item, partial=True)
+        null_columns = [column for column in REQUIRED_COLUMNS if column in values and values[column] is None]
+        if null_columns:
+            raise InvalidItem(f"Required fields can't be null: {tuple(null_columns)}.")
+        return values
+
+    def check_items(valid_items):
+        errors = find_duplicated_ids(valid_items, lambda values: values["demanda_id"])
+        old_rows.update(select_existing(values["demanda_id"] for values in valid_items.values()))
+        for index, values in valid_items.items():
+            if values["demanda_id"] not in old_rows:
+                errors[index] = InvalidItem(f"Couldn't find object with id: {values['demanda_id']}", status=404)
+        return errors
+
+    def apply_items(valid_items):
+        # bulk update by primary key, items with the same fields are sent in a single executemany.
+        db.session.execute(update(Demanda), list(valid_items.values()))
+        old_values = [old_rows[values["demanda_id"]] for values in valid_items.values()]
+        rollups.apply_changes(db.session.connection(), old_values, -1)
+        new_values = [{**old_rows[values["demanda_id"]], **values} for values in valid_items.values()]
+        rollups.apply_changes(db.session.connection(), new_values, 1)
+        return {}
+
+    return run_bulk(parse_item, check_items, apply_items, 200)
+
+
+@demandas_bulk_bp.route('/demandas/bulk/delete', methods=['DELETE'])
+def demandas_bulk_delete():
+    """ Delete many demandas, each item is a 'demanda_id' or an object with it. """
+    old_rows = {}
+
+    def check_items(valid_items):
+        errors = find_duplicated_ids(valid_items, lambda demanda_id: demanda_id)
+        old_rows.update(select_existing(valid_items.values()))
+        for index, demanda_id in valid_items.items():
+            if demanda_id not in old_rows:
+                errors[index] = InvalidItem(f"Couldn't find object with id: {demanda_id}", status=404)
+        return errors
+
+    def apply_items(valid_items):
+        ids = list(valid_items.values())
+        for i in range(0, len(ids), IDS_PER_QUERY):
+            db.session.execute(delete(Demanda).where(Demanda.demanda_id.in_(ids[i:i + IDS_PER_QUERY])))
+        rollups.apply_changes(db.session.connection(), [old_rows[demanda_id] for demanda_id in ids], -1)
+        return {}
+
+    return run_bulk(parse_id, check_items, apply_items, 200)
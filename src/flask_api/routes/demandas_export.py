@@ -0,0 +1,142 @@
+"""
+Route to export the 'Demandas' table, with the same filters of '/demandas', as ndjson, csv, arrow or parquet.
+The rows are streamed in batches read from a server side cursor, the whole result is never kept in memory.
+The arrow and parquet formats need the optional pyarrow package.
+"""
+
+import csv
+import io
+
+from flask import request, Response, Blueprint, current_app, stream_with_context
+from sqlalchemy import Integer, DateTime
+
+from flask_api.db.models import Demanda
+import flask_api.db.database as db
+from flask_api.routes.demandas import create_demandas_query
+from settings import STREAM_BATCH_SIZE
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+demandas_export_bp = Blueprint('demandas_export', __name__)
+
+MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+ARROW_FORMATS = ("arrow", "parquet")
+
+
+def read_batches(query):
+    """ Yields the rows of 'query' in lists of at most STREAM_BATCH_SIZE rows. """
+    result = db.read_session.execute(query.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE))
+    yield from result.partitions()
+
+
+def export_ndjson(batches):
+    for batch in batches:
+        yield "".join(current_app.json.dumps(row) + "\n" for row in Demanda.serialize_rows(batch))
+
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(key for key, _ in Demanda.serialized_columns())
+    for batch in batches:
+        writer.writerows(row.values() for row in Demanda.serialize_rows(batch))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def arrow_schema():
+    """ Arrow schema with the columns of Demanda. """
+    fields = []
+    for key, _ in Demanda.serialized_columns():
+        column_type = Demanda.__table__.c[key].type
+        if isinstance(column_type, Integer):
+            fields.append(pyarrow.field(key, pyarrow.int64()))
+        elif isinstance(column_type, DateTime):
+            fields.append(pyarrow.field(key, pyarrow.timestamp("us")))
+        else:
+            fields.append(pyarrow.field(key, pyarrow.string()))
+    return pyarrow.schema(fields)
+
+
+def to_record_batch(batch, schema):
+    columns = list(zip(*batch))
+    return pyarrow.RecordBatch.from_arrays([pyarrow.array(column, type=field.type)
+                                            for column, field in zip(columns, schema)], schema=schema)
+
+
+class StreamSink:
+    """
+    Write only file that keeps the written bytes until they are taken. The position is the total of bytes written,
+    as the parquet writer uses it to store the offsets of the row groups.
+    """
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        """ Returns the bytes written since the last call. """
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def export_arrow(batches, file_format):
+    """ Writes the batches as an arrow ipc stream or as a parquet file, with one row group per batch. """
+    schema = arrow_schema()
+    sink = StreamSink()
+    output = pyarrow.PythonFile(sink, mode="w")
+    if file_format == "arrow":
+        writer = pyarrow.ipc.new_stream(output, schema)
+    else:
+        writer = pyarrow.parquet.ParquetWriter(output, schema)
+    for batch in batches:
+        writer.write_batch(to_record_batch(batch, schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+@demandas_export_bp.route('/demandas/export')
+def demandas_export():
+    """ Export the demandas filtered with '?filter_column=value', as ndjson (default), csv, arrow or parquet. """
+    file_format = request.args.get("format", "ndjson")
+    if file_format not in MIMETYPES:
+        return Response(f"Invalid request: format must be one of {tuple(MIMETYPES)}.", status=400)
+    if file_format in ARROW_FORMATS and pyarrow is None:
+        return Response(f"The {file_format} format needs the pyarrow package.", status=501)
+
+    batches = read_batches(create_demandas_query())
+    if file_format == "ndjson":
+        content = export_ndjson(batches)
+    elif file_format == "csv":
+        content = export_csv(batches)
+    else:
+        content = export_arrow(batches, file_format)
+    return Response(stream_with_context(content), mimetype=MIMETYPES[file_format])
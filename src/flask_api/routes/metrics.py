@@ -0,0 +1,16 @@
+""" Route that returns the request metrics collected by flask_api.metrics. """
+
+from flask import Blueprint
+
+from flask_api.metrics import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics_summary():
+    """
+    Returns, for every endpoint, histograms of the number of queries and of the milliseconds spent in sql,
+    serialization and in total by each request.
+    """
+    return metrics.snapshot()
@@ -0,0 +1,133 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from starlette.testclient import TestClient
+
+from flask_api import metrics
+from flask_api.asgi import app
+from flask_api.cache import count_cache
+from flask_api.db import database_async
+from flask_api.db.database import Base
+from flask_api.db.models import Demanda
+
+
+class TestDemandasAsgi(unittest.TestCase):
+    DEMANDAS_BASE_ROUTE = "/demandas"
+
+    def setUp(self):
+        # the sync and async engines need to share the database, so it can't be in memory.
+        self.db_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.db_dir.name, "test.sqlite")
+        sync_engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(sync_engine)
+        with Session(sync_engine) as session:
+            for i in range(3):
+                session.add(Demanda(demanda_id=i,
+                                    razao_social=f"company {i}",
+                                    ans=i*2,
+                                    beneficiarios=i*3,
+                                    data_atendimento_demanda=datetime.datetime(2000+i, i+1, i+1, i, i, i),
+                                    classificacao_demanda=f"classificacao {i}",
+                                    natureza_demanda=f"natureza {i}",
+                                    subtema_demanda=f"subtema {i}"))
+            session.commit()
+        sync_engine.dispose()
+
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        database_async.engine = self.engine
+        database_async.session_factory = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        count_cache.clear()
+        self.app = TestClient(app)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def test_get_all_demandas(self):
+        response = self.app.get(self.DEMANDAS_BASE_ROUTE)
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.content)
+        self.assertEqual(3, len(result_json))
+        self.assertEqual({'ans': 0,
+                          'beneficiarios': 0,
+                          'classificacao_demanda': 'classificacao 0',
+                          'data_atendimento_demanda': '2000-01-01 00:00:00',
+                          'demanda_id': 0,
+                          'natureza_demanda': 'natureza 0',
+                          'razao_social': 'company 0',
+                          'subtema_demanda': 'subtema 0'}, result_json[0])
+
+    def test_get_demandas_filter_paginated(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?ans=0,2,4&limit=2")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.content)
+        self.assertEqual([0, 1], [demanda["demanda_id"] for demanda in result_json["items"]])
+        self.assertEqual(1, result_json["next_cursor"])
+
+    def test_get_demandas_stream(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?stream=true")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(json.loads(self.app.get(self.DEMANDAS_BASE_ROUTE).content), json.loads(response.content))
+
+    def test_unknown_column(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=something")
+        self.assertEqual(400, response.status_code)
+
+    def test_demandas_count_group_by(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans&ans=0,4")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("MISS", response.headers["X-Cache"])
+        self.assertEqual([{"ans": 0, "total": 1}, {"ans": 4, "total": 1}], json.loads(response.content))
+
+    def test_row_limit(self):
+        with patch("flask_api.utils.MAX_QUERY_ROWS", 2):
+            self.assertEqual(400, self.app.get(self.DEMANDAS_BASE_ROUTE).status_code)
+            self.assertEqual(400, self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans").status_code)
+            self.assertEqual(2, len(json.loads(self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?ans=0,2").content)))
+
+    def test_server_timing(self):
+        metrics.metrics.clear()
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?limit=2")
+        self.assertIn('desc="1 queries"', response.headers["Server-Timing"])
+        self.assertRegex(response.headers["Server-Timing"], r"serialize;dur=[\d.]+, total;dur=[\d.]+$")
+
+        result_json = json.loads(self.app.get("/metrics").content)
+        self.assertEqual(1, result_json["demandas"]["queries"]["count"])
+
+    def test_add_update_delete(self):
+        response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 12345, "razao_social": "test"})
+        self.assertEqual(201, response.status_code)
+
+        response = self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/3",
+                                data={"razao_social": "updated", "data_atendimento_demanda": "2049-12-01 01:23:45"})
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?demanda_id=3").content)
+        self.assertEqual("updated", result_json[0]["razao_social"])
+        self.assertEqual("2049-12-01 01:23:45", result_json[0]["data_atendimento_demanda"])
+
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/3")
+        self.assertEqual(200, response.status_code)
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/3")
+        self.assertEqual(404, response.status_code)
+
+    def test_add_missing_field(self):
+        response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"razao_social": "test"})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("Missing required field: ('ans',).", response.text)
+
+    def test_update_doesnt_exist(self):
+        response = self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/1234", data={"ans": 1})
+        self.assertEqual(404, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import delete
+
+from flask_api.db.column_store import column_store
+from flask_api.db.models import Demanda
+from flask_api.db.rollups import find_rollup
+from flask_api.routes.demandas import create_count_query
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestColumnStore(DemandasTestCase):
+    def setUp(self):
+        super().setUp()
+        # repeated values and nulls, inserted out of order so the codes don't follow the ids.
+        for i, (razao_social, ans, classificacao) in enumerate([("company 9", 4, None), ("company 1", None, None),
+                                                                ("company 0", 2, "classificacao 1")]):
+            self.db_session.add(Demanda(demanda_id=10 + i, razao_social=razao_social, ans=ans,
+                                        classificacao_demanda=classificacao))
+        self.db_session.commit()
+        self.snapshot = column_store.load(self.db_session.connection())
+        column_store.enabled = True
+
+    def tearDown(self):
+        column_store.enabled = False
+        column_store.snapshot = None
+
+    def sql_count(self, group_columns, args):
+        return [row._asdict() for row in self.db_session.execute(create_count_query(group_columns, args=args))]
+
+    def test_count_matches_sql(self):
+        cases = [
+            ([], {}),
+            ([], {"ans": "2,4"}),
+            (["razao_social"], {}),
+            (["ans"], {}),
+            (["classificacao_demanda", "razao_social"], {}),
+            (["natureza_demanda", "classificacao_demanda"], {}),
+            (["ans", "natureza_demanda"], {"razao_social": "company 0,company 9,unknown"}),
+            (["beneficiarios"], {"ans": "-1,0,002"}),
+            (["subtema_demanda"], {"classificacao_demanda": "classificacao 1", "ans": "2"}),
+            (["razao_social"], {"ans": "123"}),
+        ]
+        for group_columns, filters in cases:
+            with self.subTest(group_columns=group_columns, filters=filters):
+                expected = self.sql_count(group_columns, filters)
+                filters = {column: values.split(",") for column, values in filters.items()}
+                self.assertEqual(expected, self.snapshot.count(group_columns, filters))
+
+    def test_groups_sorted_by_value(self):
+        # values coded after the others that sort before them.
+        self.db_session.add(Demanda(demanda_id=20, razao_social="a company", natureza_demanda="a natureza"))
+        self.db_session.commit()
+        snapshot = column_store.load(self.db_session.connection())
+        self.build_rollups()
+
+        for column in ("razao_social", "natureza_demanda", "classificacao_demanda"):
+            with self.subTest(column=column):
+                expected = self.sql_count([column], {})
+                values = [row[column] for row in expected]
+                self.assertEqual([value for value in values if value is None] + sorted(filter(None, values)), values)
+                rollup = find_rollup([column])
+                if rollup is not None:
+                    self.assertEqual(expected, [row._asdict() for row in self.db_session.execute(
+                        create_count_query([column], rollup, args={}))])
+                self.assertEqual(expected, snapshot.count([column], {}))
+
+    def test_count_unsupported(self):
+        # columns that are not in the store and values sqlite would convert are left to sqlite.
+        self.assertIsNone(self.snapshot.count(["data_atendimento_demanda"], {}))
+        self.assertIsNone(self.snapshot.count([], {"ans": ["2.0"]}))
+        self.assertIsNone(self.snapshot.count(["ans", "ans"], {}))
+
+    def test_route_uses_snapshot(self):
+        # a change the snapshot doesn't know about, because the count cache wasn't cleared.
+        self.db_session.execute(delete(Demanda).where(Demanda.razao_social == "company 9"))
+        self.db_session.commit()
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans&razao_social=company%209")
+        self.assertEqual([{"total": 1, "ans": 4}], json.loads(response.data))
+
+    def test_outdated_after_write(self):
+        with patch.object(column_store, "refresh") as refresh:
+            self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/10")
+            response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans&razao_social=company%209")
+            self.assertEqual([], json.loads(response.data))
+            refresh.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.generate_data import generate_csv
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from db_utility.data_loader import DEMANDAS_COLUMNS, DataLoader, DemandasLoader, main
+from flask_api.db.database import Base
+from flask_api.db.models import Demanda
+from flask_api.db.rollups import ROLLUPS
+from flask_api.db.search import SEARCH_TABLE
+
+ROWS = 300
+
+# Demandas with the text columns read from their lookup tables, like the api returns them.
+DECODED_QUERY = """
+SELECT d.demanda_id, d.ans, r.value, d.beneficiarios, d.data_atendimento_demanda, c.value, n.value, s.value,
+       d.ultima_atualizacao
+FROM Demandas d
+LEFT JOIN Demandas_razao_social r ON r.code = d.razao_social
+LEFT JOIN Demandas_classificacao_demanda c ON c.code = d.classificacao_demanda
+LEFT JOIN Demandas_natureza_demanda n ON n.code = d.natureza_demanda
+LEFT JOIN Demandas_subtema_demanda s ON s.code = d.subtema_demanda
+ORDER BY d.demanda_id
+"""
+
+
+class LoaderTestCase(unittest.TestCase):
+    """ Base test case with a small generated csv in a temporary directory. """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv_path = self.path("demandas.csv")
+        generate_csv(self.csv_path, ROWS, seed=1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def load(self, database_name, *args):
+        """ Runs the loader command line with 'args' into a new database, returns the database path. """
+        database_path = self.path(database_name)
+        main(["--file", self.csv_path, "--database", f"sqlite:///{database_path}", *args])
+        return database_path
+
+    @staticmethod
+    def query(database_path, sql, parameters=()):
+        with closing(sqlite3.connect(database_path)) as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def decoded_rows(self, database_path):
+        return self.query(database_path, DECODED_QUERY)
+
+
+class TestLoaderCommandLine(LoaderTestCase):
+    def read_expected(self):
+        """ The csv rows read directly by pandas, without the loader. """
+        # like the loader, the first row after the header is skipped.
+        data = pd.read_csv(self.csv_path, sep=";", encoding="ISO-8859-1", skiprows=[1])
+        return {row.ID_DEMANDA: (row.REGISTRO_ANS, row.RAZAO_SOCIAL, row.QTD_BENEFICIARIOS, row.CLASSIFICACAO,
+                                 row.NATUREZA_DEMANDA, row.SUBTEMA_DEMANDA) for row in data.itertuples()}
+
+    def split_csv_in_folder(self, folder_name):
+        """ Writes the csv rows to two csvs in a folder, both starting with the lines the loader skips. """
+        with open(self.csv_path, encoding="ISO-8859-1") as csv_file:
+            lines = csv_file.readlines()
+        folder = self.path(folder_name)
+        os.mkdir(folder)
+        middle = len(lines) // 2
+        for name, rows in (("a.csv", lines[2:middle]), ("b.csv", lines[middle:])):
+            with open(os.path.join(folder, name), "w", encoding="ISO-8859-1") as csv_file:
+                csv_file.writelines(lines[:2] + rows)
+        return folder
+
+    def assert_encoded(self, database_path):
+        for column in ("razao_social", "classificacao_demanda", "natureza_demanda", "subtema_demanda"):
+            self.assertEqual([("integer",)], self.query(database_path, f"SELECT DISTINCT typeof({column}) "
+                                                                       f"FROM Demandas"))
+            self.assertGreater(self.query(database_path, f"SELECT count(*) FROM Demandas_{column}")[0][0], 0)
+
+    def test_every_mode_loads_the_same_rows(self):
+        streamed = self.load("streamed.sqlite")
+        self.assert_encoded(streamed)
+        decoded = self.decoded_rows(streamed)
+        expected = self.read_expected()
+        self.assertEqual(ROWS, len(decoded))
+        self.assertEqual(expected, {row[0]: row[1:4] + row[5:8] for row in decoded})
+
+        folder = self.split_csv_in_folder("folder")
+        modes = {
+            "small chunks": ["--chunksize", "7"],
+            "whole file": ["--chunksize", "0"],
+            "folder": ["--folder", folder],
+            "parallel": ["--workers", "2"],
+            "parallel folder": ["--workers", "2", "--folder", folder],
+            "delta into a new table": ["--delta"],
+        }
+        for i, (mode, args) in enumerate(modes.items()):
+            with self.subTest(mode=mode):
+                database_path = self.load(f"mode_{i}.sqlite", *args)
+                self.assert_encoded(database_path)
+                self.assertEqual(decoded, self.decoded_rows(database_path))
+
+    def test_publish_snapshot(self):
+        snapshot_path = self.path("snapshot.sqlite")
+        database_path = self.load("db.sqlite", "--publish-snapshot", snapshot_path)
+        self.assertEqual(self.decoded_rows(database_path), self.decoded_rows(snapshot_path))
+
+
+class TestLoaderModes(LoaderTestCase):
+    def load_parallel(self, database_name, split_size):
+        """ Loads the csv with 2 workers, in parts of about 'split_size' bytes. """
+        database_path = self.path(database_name)
+        engine = create_engine(f"sqlite:///{database_path}")
+        loader = DemandasLoader("Demandas", engine, DEMANDAS_COLUMNS)
+        loader.create_table(True)
+        loader.parallel_load_to_database([self.csv_path], 2, split_size)
+        loader.post_load()
+        engine.dispose()
+        return database_path
+
+    def stored_tables(self, database_path):
+        """ The stored rows of Demandas and of its lookup tables, with the codes. """
+        tables = {"Demandas": self.query(database_path, "SELECT * FROM Demandas ORDER BY demanda_id")}
+        for column in ("razao_social", "classificacao_demanda", "natureza_demanda", "subtema_demanda"):
+            tables[column] = self.query(database_path, f"SELECT code, value FROM Demandas_{column} ORDER BY code")
+        return tables
+
+    def test_same_tables_and_codes(self):
+        split_size = 1000
+        self.assertGreater(len(DataLoader._split_file(self.csv_path, split_size)), 10)
+
+        chunked = self.stored_tables(self.load("chunked.sqlite", "--chunksize", "7"))
+        self.assertEqual(ROWS, len(chunked["Demandas"]))
+        self.assertEqual(chunked, self.stored_tables(self.load("whole.sqlite", "--chunksize", "0")))
+        self.assertEqual(chunked, self.stored_tables(self.load_parallel("parallel.sqlite", split_size)))
+
+
+class TestDeltaLoad(LoaderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.database_path = self.load("db.sqlite")
+        self.engine = create_engine(f"sqlite:///{self.database_path}")
+        with open(self.csv_path, encoding="ISO-8859-1") as csv_file:
+            self.lines = csv_file.readlines()
+        # the csv fields of the first rows, by demanda_id.
+        self.rows = {int(fields[3]): fields for fields in (line.rstrip("\n").split(";") for line in self.lines[2:6])}
+        self.ids = list(self.rows)
+
+    def tearDown(self):
+        self.engine.dispose()
+        super().tearDown()
+
+    def delta_load(self, rows, name="delta.csv"):
+        """ Writes a csv with the csv 'rows' and upserts it, returns the number of upserted rows. """
+        delta_path = self.path(name)
+        with open(delta_path, "w", encoding="ISO-8859-1") as csv_file:
+            csv_file.writelines(self.lines[:2] + [";".join(fields) + "\n" for fields in rows])
+        loader = DemandasLoader("Demandas", self.engine, DEMANDAS_COLUMNS)
+        loader.create_table(False)
+        return loader.delta_load_to_database(delta_path)
+
+    def changed_rows(self):
+        unchanged, changed_subtema, changed_update, new = (list(self.rows[demanda_id]) for demanda_id in self.ids)
+        changed_subtema[7] = "Subtema novo de reembolso"
+        changed_update[9] = "02/02/2024"
+        new[3] = str(ROWS + 100)
+        return [unchanged, changed_subtema, changed_update, new]
+
+    def decoded_row(self, demanda_id):
+        return self.query(self.database_path, f"SELECT * FROM ({DECODED_QUERY}) WHERE demanda_id = ?",
+                          (demanda_id,))[0]
+
+    def test_upsert(self):
+        unchanged = self.decoded_row(self.ids[0])
+        self.assertEqual(3, self.delta_load(self.changed_rows()))
+
+        self.assertEqual(ROWS + 1, self.query(self.database_path, "SELECT count(*) FROM Demandas")[0][0])
+        self.assertEqual(unchanged, self.decoded_row(self.ids[0]))
+        self.assertEqual("Subtema novo de reembolso", self.decoded_row(self.ids[1])[7])
+        self.assertEqual("2024-02-02 00:00:00.000000", self.decoded_row(self.ids[2])[8])
+        self.assertEqual(self.decoded_row(self.ids[3])[1:], self.decoded_row(ROWS + 100)[1:])
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        self.assertEqual(0, self.delta_load(self.rows.values(), "unchanged.csv"))
+        self.assertEqual(3, self.delta_load(self.changed_rows()))
+        self.assertEqual(0, self.delta_load(self.changed_rows(), "same_delta.csv"))
+
+    def test_rollups_and_search_follow_upsert(self):
+        self.delta_load(self.changed_rows())
+        with self.engine.connect() as connection:
+            for rollup in ROLLUPS:
+                with self.subTest(rollup=rollup.name):
+                    self.assertEqual(set(connection.execute(rollup.build_query()).all()),
+                                     set(connection.execute(select(rollup.table)).all()))
+            matches = connection.exec_driver_sql(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} "
+                                                 f"MATCH 'reembolso'").all()
+            self.assertEqual([(self.ids[1],)], matches)
+            # fails if the index doesn't match the decoded content of Demandas.
+            connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) "
+                                       f"VALUES ('integrity-check', 1)")
+
+    def test_old_table_gets_new_column(self):
+        with closing(sqlite3.connect(self.database_path)) as connection:
+            connection.execute("ALTER TABLE Demandas DROP COLUMN ultima_atualizacao")
+        self.engine.dispose()
+
+        # the new column is null in the old rows, so the rows of the csv that already existed are updated too.
+        self.assertEqual(4, self.delta_load(self.changed_rows()))
+        columns = [row[1] for row in self.query(self.database_path, "PRAGMA table_info(Demandas)")]
+        self.assertIn("ultima_atualizacao", columns)
+        self.assertEqual("2024-02-02 00:00:00.000000", self.decoded_row(self.ids[2])[8])
+
+
+def strptime_date(date_string):
+    """ How the loader parsed the dates before parse_dates, one row at a time. """
+    try:
+        return datetime.strptime(date_string, "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return datetime.strptime(date_string, "%d/%m/%Y")
+
+
+class TestParseDates(unittest.TestCase):
+    DATES = ["05/03/2021 14:07:09", "31/12/2019", "01/01/2000 00:00:00", "29/02/2020 23:59:59", "7/3/2021 1:2:3",
+             "7/3/2021", "28/02/2023 00:00:01"]
+
+    def test_same_dates_as_strptime(self):
+        parsed = DemandasLoader.parse_dates(pd.Series(self.DATES))
+        self.assertEqual([strptime_date(date) for date in self.DATES], parsed.tolist())
+
+    def test_unparsed_dates_are_null(self):
+        dates = pd.Series(["05/03/2021", "not a date", "2021-03-05", None, "32/01/2021"])
+        with self.assertLogs("db_utility.data_loader", "WARNING") as logs:
+            parsed = DemandasLoader.parse_dates(dates, 4)
+        self.assertEqual([False, True, True, True, True], parsed.isna().tolist())
+        # the missing value is not counted as unparsed.
+        self.assertEqual(["WARNING:db_utility.data_loader:Chunk 4: 3 dates could not be parsed and were set to null."],
+                         logs.output)
+
+    def test_stored_dates_read_by_the_model(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        loader = DemandasLoader("Demandas", engine, DEMANDAS_COLUMNS)
+        data = pd.DataFrame({"ans": 1, "razao_social": pd.Categorical(["company"] * len(self.DATES)),
+                             "data_atendimento_demanda": DemandasLoader.parse_dates(pd.Series(self.DATES))},
+                            index=pd.Index(range(len(self.DATES)), name="demanda_id"))
+        with engine.begin() as connection:
+            loader._bulk_insert(connection, data)
+
+        with Session(engine) as session:
+            dates = session.scalars(select(Demanda.data_atendimento_demanda).order_by(Demanda.demanda_id)).all()
+        self.assertEqual([strptime_date(date) for date in self.DATES], dates)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
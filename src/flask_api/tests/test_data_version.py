@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from flask_api.db import database
+from flask_api.db.column_store import column_store
+from flask_api.db.database import Base
+from flask_api.db.rollups import build_rollups
+from flask_api.db.search import build_search_index
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestDataVersion(DemandasTestCase):
+    def create_db(self):
+        # a database file, so another connection can write to it like another process would.
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "db.sqlite")
+        self.engine = create_engine(f"sqlite:///{self.database_path}")
+        self.db_session = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        Base.query = self.db_session.query_property()
+        database.engine = database.read_engine = self.engine
+        database.session = self.db_session
+        database.read_session = self.db_session
+
+    def tearDown(self):
+        column_store.enabled = False
+        column_store.snapshot = None
+        self.db_session.remove()
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def write_from_other_connection(self, sql):
+        with closing(sqlite3.connect(self.database_path)) as connection:
+            connection.execute(sql)
+            connection.commit()
+
+    def test_count_cache_cleared(self):
+        route = f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans"
+        self.assertEqual(3, len(json.loads(self.app.get(route).data)))
+        self.assertEqual("HIT", self.app.get(route).headers["X-Cache"])
+
+        self.write_from_other_connection("DELETE FROM Demandas WHERE demanda_id = 0")
+        response = self.app.get(route)
+        self.assertEqual("MISS", response.headers["X-Cache"])
+        self.assertEqual([{"total": 1, "ans": 2}, {"total": 1, "ans": 4}], json.loads(response.data))
+
+    def test_column_store_reloaded(self):
+        column_store.enabled = True
+        with self.engine.connect() as connection:
+            column_store.load(connection)
+        route = f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=razao_social"
+        with patch.object(column_store, "refresh") as refresh:
+            self.assertEqual(3, len(json.loads(self.app.get(route).data)))
+            refresh.assert_not_called()
+
+            self.write_from_other_connection("DELETE FROM Demandas WHERE demanda_id = 0")
+            # the outdated snapshot isn't used, sqlite answers until the new one is loaded.
+            self.assertEqual(2, len(json.loads(self.app.get(route).data)))
+            refresh.assert_called_once()
+
+    def test_rollups_built_by_other_process(self):
+        route = f"{self.DEMANDAS_BASE_ROUTE}/explain/count?group_by=natureza_demanda"
+        self.assertNotIn("Demandas_rollup_", json.loads(self.app.get(route).data)["query"])
+
+        other_engine = create_engine(f"sqlite:///{self.database_path}")
+        with other_engine.begin() as connection:
+            build_rollups(connection)
+        other_engine.dispose()
+        self.assertIn("Demandas_rollup_natureza_demanda", json.loads(self.app.get(route).data)["query"])
+
+    def test_search_index_built_by_other_process(self):
+        route = f"{self.DEMANDAS_BASE_ROUTE}/search?q=company"
+        self.assertEqual(503, self.app.get(route).status_code)
+
+        other_engine = create_engine(f"sqlite:///{self.database_path}")
+        with other_engine.begin() as connection:
+            build_search_index(connection)
+        other_engine.dispose()
+        response = self.app.get(route)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(json.loads(response.data)["items"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from flask_api.db.database import Base, create_profile_engine
+from flask_api.db.models import Demanda
+from settings import DATABASE_PROFILES
+
+
+class TestProductionProfile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        database_path = f"sqlite:///{os.path.join(self.directory.name, 'db.sqlite')}"
+        profile = DATABASE_PROFILES["production"]
+        # the engines and sessions of the production profile, like flask_api.db.database creates them.
+        self.engine = create_profile_engine(database_path, profile)
+        self.read_engine = create_profile_engine(database_path, profile, read_only=True)
+        self.session = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        self.read_session = scoped_session(sessionmaker(autoflush=False, bind=self.read_engine))
+        Base.metadata.create_all(bind=self.engine)
+
+    def tearDown(self):
+        self.session.remove()
+        self.read_session.remove()
+        self.engine.dispose()
+        self.read_engine.dispose()
+        self.directory.cleanup()
+
+    @staticmethod
+    def pragma(session, name):
+        return session.connection().exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_pragmas(self):
+        self.assertEqual("wal", self.pragma(self.session, "journal_mode"))
+        self.assertEqual(1, self.pragma(self.session, "synchronous"))  # NORMAL
+        self.assertEqual(-65536, self.pragma(self.session, "cache_size"))
+        self.assertEqual(5000, self.pragma(self.session, "busy_timeout"))
+        self.assertEqual(0, self.pragma(self.session, "query_only"))
+        # the journal mode is a property of the database file, the read only connections see it too.
+        self.assertEqual("wal", self.pragma(self.read_session, "journal_mode"))
+        self.assertEqual(1, self.pragma(self.read_session, "query_only"))
+
+    def test_read_session_refuses_writes(self):
+        self.read_session.add(Demanda(demanda_id=1, ans=1, razao_social="company"))
+        with self.assertRaisesRegex(OperationalError, "attempt to write a readonly database"):
+            self.read_session.commit()
+        self.read_session.rollback()
+
+        self.session.add(Demanda(demanda_id=1, ans=1, razao_social="company"))
+        self.session.commit()
+        self.assertEqual(1, self.read_session.execute(select(func.count(Demanda.demanda_id))).scalar())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,21 @@ import datetime
 import json
 import unittest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, func
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 from flask_api.app import app
+from flask_api.cache import count_cache
 from flask_api.db import database
 from flask_api.db.database import init_db, Base
+from flask_api.db.rollups import build_rollups, find_rollup
+from flask_api.db.search import build_search_index
 from flask_api.db.models import Demanda
 from flask_api.db.models.serializer import serialize
 
 
-class TestDemandas(unittest.TestCase):
+class DemandasTestCase(unittest.TestCase):
+    """ Base test case with an in memory database populated with 3 demandas. """
     DEMANDAS_BASE_ROUTE = "/demandas"
 
     def create_db(self):
@@ -26,6 +30,7 @@ class TestDemandas(unittest.TestCase):
 
         database.engine = self.engine
         database.session = self.db_session
+        database.read_session = self.db_session
 
     def populate_db(self):
         for i in range(3):
@@ -40,16 +45,30 @@ class TestDemandas(unittest.TestCase):
             self.mock_demandas.append(mock_demanda)
             self.db_session.add(mock_demanda)
         self.db_session.commit()
+        # load the attributes expired by the commit, so the mocks can still be serialized after the session is closed.
+        for mock_demanda in self.mock_demandas:
+            self.db_session.refresh(mock_demanda)
 
     def setUp(self):
         self.app = app.test_client()
 
         self.create_db()
         init_db()
+        count_cache.clear()
 
         self.mock_demandas = []
         self.populate_db()
 
+    def build_rollups(self):
+        with self.engine.begin() as connection:
+            build_rollups(connection)
+
+    def build_search_index(self):
+        with self.engine.begin() as connection:
+            build_search_index(connection)
+
+
+class TestDemandas(DemandasTestCase):
     def test_invalid_route(self):
         response = self.app.get("/notreallyavalidroute")
         self.assertEqual(404, response.status_code)
@@ -100,6 +119,81 @@ class TestDemandas(unittest.TestCase):
         result_json = json.loads(response.data)
         self.assertEqual(0, len(result_json))
 
+    def test_get_demandas_paginated(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?limit=2")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual(serialize(self.mock_demandas[:2]), result_json["items"])
+        self.assertEqual(1, result_json["next_cursor"])
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?limit=2&after={result_json['next_cursor']}")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual([serialize(self.mock_demandas[2])], result_json["items"])
+        self.assertIsNone(result_json["next_cursor"])
+
+    def test_get_demandas_paginated_filter(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?ans=2,4&after=1")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual([serialize(self.mock_demandas[2])], result_json["items"])
+        self.assertIsNone(result_json["next_cursor"])
+
+    def test_get_demandas_paginated_invalid_limit(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?limit=0")
+        self.assertEqual(400, response.status_code)
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?after=abc")
+        self.assertEqual(400, response.status_code)
+
+    def test_get_demandas_stream(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?stream=true")
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.is_streamed)
+
+        result_json = json.loads(response.data)
+        self.assertEqual(serialize(self.mock_demandas), result_json)
+
+    def test_get_demandas_stream_empty(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?stream=true&ans=1234")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], json.loads(response.data))
+
+    def test_get_demandas_fields(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=ans,razao_social&ans=2")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{"ans": 2, "razao_social": "company 1"}], json.loads(response.data))
+
+    def test_get_demandas_fields_paginated(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=data_atendimento_demanda&limit=2")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        expected = [{"data_atendimento_demanda": demanda["data_atendimento_demanda"]}
+                    for demanda in serialize(self.mock_demandas[:2])]
+        self.assertEqual(expected, result_json["items"])
+        self.assertEqual(1, result_json["next_cursor"])
+
+    def test_get_demandas_fields_stream(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=demanda_id&stream=true")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{"demanda_id": i} for i in range(3)], json.loads(response.data))
+
+    def test_get_demandas_invalid_fields(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=ans,something")
+        self.assertEqual(400, response.status_code)
+
+    def test_demandas_explain_fields_covering_index(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/demandas"
+                                f"?fields=demanda_id,ans,data_atendimento_demanda&ans=2")
+        self.assertEqual(200, response.status_code)
+
+        plan = json.loads(response.data)["plan"]
+        self.assertTrue(any("COVERING INDEX ix_demandas_ans_data_atendimento_demanda" in step for step in plan))
+
     def test_demandas_count(self):
         response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
         self.assertEqual(200, response.status_code)
@@ -128,6 +222,123 @@ class TestDemandas(unittest.TestCase):
         self.assertEqual(1, len(result_json))
         self.assertEqual({"total": 1}, result_json[0])
 
+    def test_demandas_count_cache(self):
+        stats_before = count_cache.stats()
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans&ans=4,0")
+        self.assertEqual("MISS", response.headers["X-Cache"])
+
+        # same filters in a different order use the same cache entry.
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?ans=0,4&group_by=ans")
+        self.assertEqual("HIT", response.headers["X-Cache"])
+        self.assertEqual([{"ans": 0, "total": 1}, {"ans": 4, "total": 1}], json.loads(response.data))
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count/cache")
+        self.assertEqual(200, response.status_code)
+        stats = json.loads(response.data)
+        self.assertEqual(stats_before["hits"] + 1, stats["hits"])
+        self.assertEqual(stats_before["misses"] + 1, stats["misses"])
+        self.assertEqual(1, stats["size"])
+
+    def test_demandas_count_cache_invalidated_on_write(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertEqual("MISS", response.headers["X-Cache"])
+
+        response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 12345, "razao_social": "test"})
+        self.assertEqual(201, response.status_code)
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertEqual("MISS", response.headers["X-Cache"])
+        self.assertEqual([{"total": 4}], json.loads(response.data))
+
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/0")
+        self.assertEqual(200, response.status_code)
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertEqual("MISS", response.headers["X-Cache"])
+        self.assertEqual([{"total": 3}], json.loads(response.data))
+
+    def test_find_rollup(self):
+        self.assertEqual("razao_social", find_rollup(["razao_social"]).name)
+        self.assertEqual("razao_social_classificacao_demanda",
+                         find_rollup(["classificacao_demanda", "razao_social"]).name)
+        self.assertIsNone(find_rollup(["ans"]))
+
+    def test_demandas_count_rollup(self):
+        self.build_rollups()
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertEqual([{"total": 3}], json.loads(response.data))
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=razao_social,classificacao_demanda"
+                                f"&razao_social=company%200,company%202")
+        self.assertEqual([
+            {"razao_social": "company 0", "classificacao_demanda": "classificacao 0", "total": 1},
+            {"razao_social": "company 2", "classificacao_demanda": "classificacao 2", "total": 1}
+        ], json.loads(response.data))
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?natureza_demanda=nothing")
+        self.assertEqual([{"total": 0}], json.loads(response.data))
+
+    def test_demandas_count_rollup_incremental(self):
+        self.build_rollups()
+        route = f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=classificacao_demanda"
+
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company 0",
+                                                               "classificacao_demanda": "classificacao 0"})
+        self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/1", data={"classificacao_demanda": "classificacao 0"})
+        self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/2")
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company 5"})
+
+        expected = [{"classificacao_demanda": None, "total": 1},
+                    {"classificacao_demanda": "classificacao 0", "total": 3}]
+        self.assertEqual(expected, json.loads(self.app.get(route).data))
+
+        # the rollup must match a count over the base table.
+        with self.engine.connect() as connection:
+            query = select(Demanda.classificacao_demanda, func.count().label("total")) \
+                .group_by(Demanda.classificacao_demanda)
+            self.assertEqual(expected, [row._asdict() for row in connection.execute(query)])
+
+    def test_demandas_explain_uses_index(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/demandas?razao_social=company%200")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertIn("'company 0'", result_json["query"])
+        self.assertTrue(any("ix_demandas_razao_social" in step for step in result_json["plan"]))
+        self.assertEqual([], result_json["full_scans"])
+
+    def test_demandas_explain_value_with_colon(self):
+        # the filter values are bound parameters, a ':name' in a value is not read as one.
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/demandas?razao_social=x%20:y,company%200")
+        self.assertEqual(200, response.status_code)
+        self.assertIn("'x :y'", json.loads(response.data)["query"])
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/timeseries?bucket=day&from=2000-01-01"
+                                f"&to=2001-12-31&razao_social=a:b")
+        self.assertEqual(200, response.status_code)
+
+    def test_demandas_explain_count(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/count?group_by=classificacao_demanda"
+                                f"&razao_social=company%200")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], json.loads(response.data)["full_scans"])
+
+    def test_demandas_explain_full_scan(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/count?beneficiarios=3")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(["SCAN Demandas"], json.loads(response.data)["full_scans"])
+
+    def test_demandas_explain_index_scan(self):
+        # grouped by the first column of an index, sqlite reads the whole index instead of the table.
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/count?group_by=ans,natureza_demanda")
+        full_scans = json.loads(response.data)["full_scans"]
+        self.assertEqual(1, len(full_scans))
+        self.assertRegex(full_scans[0], r"^SCAN Demandas USING (COVERING )?INDEX ix_demandas_ans_data_atendimento")
+
+    def test_demandas_explain_unknown_route(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/something")
+        self.assertEqual(404, response.status_code)
+
     def test_add_new_demanda_00(self):
         demanda_fields = {"ans": 12345, "razao_social": "test"}
         response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data=demanda_fields)
@@ -0,0 +1,111 @@
+import json
+
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestDemandasBulk(DemandasTestCase):
+    BULK_ROUTE = "/demandas/bulk"
+
+    def get_demandas(self, query=""):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}{query}")
+        return json.loads(response.data)
+
+    def test_bulk_add(self):
+        items = [{"ans": 10, "razao_social": "new 0"},
+                 {"ans": 11, "razao_social": "new 1", "demanda_id": 100,
+                  "data_atendimento_demanda": "2020-01-02 03:04:05"}]
+        response = self.app.post(f"{self.BULK_ROUTE}/add", json=items)
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual(2, result_json["applied"])
+        self.assertEqual([{"index": 0, "status": 201, "demanda_id": 3},
+                          {"index": 1, "status": 201, "demanda_id": 100}], result_json["results"])
+        self.assertEqual({"ans": 11,
+                          "beneficiarios": None,
+                          "classificacao_demanda": None,
+                          "data_atendimento_demanda": "2020-01-02 03:04:05",
+                          "demanda_id": 100,
+                          "natureza_demanda": None,
+                          "razao_social": "new 1",
+                          "subtema_demanda": None}, self.get_demandas("?demanda_id=100")[0])
+
+    def test_bulk_add_ndjson(self):
+        body = '{"ans": 10, "razao_social": "new 0"}\n{"ans": 11, "razao_social": "new 1"}\n'
+        response = self.app.post(f"{self.BULK_ROUTE}/add", data=body, content_type="application/x-ndjson")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, len(self.get_demandas()))
+
+    def test_bulk_add_atomic_invalid(self):
+        items = [{"ans": 10, "razao_social": "new 0"},
+                 {"razao_social": "missing ans"},
+                 {"ans": 12, "razao_social": "existing id", "demanda_id": 0}]
+        response = self.app.post(f"{self.BULK_ROUTE}/add", json=items)
+        self.assertEqual(400, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual(0, result_json["applied"])
+        self.assertEqual([424, 400, 409], [result["status"] for result in result_json["results"]])
+        self.assertEqual("Missing required field: ('ans',).", result_json["results"][1]["message"])
+        self.assertEqual(3, len(self.get_demandas()))
+
+    def test_bulk_add_best_effort(self):
+        items = [{"ans": 10, "razao_social": "new 0"},
+                 {"ans": 11, "razao_social": "bad date", "data_atendimento_demanda": "123"}]
+        response = self.app.post(f"{self.BULK_ROUTE}/add?mode=best_effort", json=items)
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual(1, result_json["applied"])
+        self.assertEqual([201, 400], [result["status"] for result in result_json["results"]])
+        self.assertEqual(4, len(self.get_demandas()))
+
+    def test_bulk_invalid_body(self):
+        response = self.app.post(f"{self.BULK_ROUTE}/add", data="not json")
+        self.assertEqual(400, response.status_code)
+
+        response = self.app.post(f"{self.BULK_ROUTE}/add", json={"ans": 1})
+        self.assertEqual(400, response.status_code)
+
+        response = self.app.post(f"{self.BULK_ROUTE}/add?mode=whatever", json=[])
+        self.assertEqual(400, response.status_code)
+
+    def test_bulk_update(self):
+        items = [{"demanda_id": 0, "ans": 100},
+                 {"demanda_id": 2, "razao_social": "updated", "data_atendimento_demanda": "2021-01-01 00:00:00"}]
+        response = self.app.put(f"{self.BULK_ROUTE}/update", json=items)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, json.loads(response.data)["applied"])
+
+        result_json = self.get_demandas()
+        self.assertEqual(100, result_json[0]["ans"])
+        self.assertEqual("company 0", result_json[0]["razao_social"])
+        self.assertEqual("updated", result_json[2]["razao_social"])
+        self.assertEqual("2021-01-01 00:00:00", result_json[2]["data_atendimento_demanda"])
+
+    def test_bulk_update_best_effort(self):
+        items = [{"demanda_id": 1, "ans": 100}, {"demanda_id": 1234, "ans": 1}, {"demanda_id": 2, "razao_social": None}]
+        response = self.app.put(f"{self.BULK_ROUTE}/update?mode=best_effort", json=items)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([200, 404, 400], [result["status"] for result in json.loads(response.data)["results"]])
+        self.assertEqual(100, self.get_demandas("?demanda_id=1")[0]["ans"])
+
+    def test_bulk_delete(self):
+        response = self.app.delete(f"{self.BULK_ROUTE}/delete", json=[0, {"demanda_id": 2}])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([1], [demanda["demanda_id"] for demanda in self.get_demandas()])
+
+    def test_bulk_delete_atomic_missing(self):
+        response = self.app.delete(f"{self.BULK_ROUTE}/delete", json=[0, 0, 1234])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([424, 409, 404], [result["status"] for result in json.loads(response.data)["results"]])
+        self.assertEqual(3, len(self.get_demandas()))
+
+    def test_bulk_changes_rollups(self):
+        self.build_rollups()
+        self.app.post(f"{self.BULK_ROUTE}/add", json=[{"ans": 1, "razao_social": "company 0"}])
+        self.app.put(f"{self.BULK_ROUTE}/update", json=[{"demanda_id": 1, "razao_social": "company 0"}])
+        self.app.delete(f"{self.BULK_ROUTE}/delete", json=[2])
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=razao_social")
+        self.assertEqual([{"razao_social": "company 0", "total": 3}], json.loads(response.data))
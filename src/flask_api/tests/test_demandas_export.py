@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+import unittest
+
+from flask_api.routes import demandas_export
+from flask_api.tests.test_demandas import DemandasTestCase
+from flask_api.db.models.serializer import serialize
+
+
+class TestDemandasExport(DemandasTestCase):
+    EXPORT_ROUTE = "/demandas/export"
+
+    def test_export_ndjson(self):
+        response = self.app.get(self.EXPORT_ROUTE)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-ndjson", response.mimetype)
+        self.assertTrue(response.is_streamed)
+
+        result_json = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(serialize(self.mock_demandas), result_json)
+
+    def test_export_ndjson_filter(self):
+        response = self.app.get(f"{self.EXPORT_ROUTE}?format=ndjson&ans=0,4")
+        self.assertEqual(200, response.status_code)
+
+        result_json = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(serialize([self.mock_demandas[0], self.mock_demandas[2]]), result_json)
+
+    def test_export_csv(self):
+        response = self.app.get(f"{self.EXPORT_ROUTE}?format=csv")
+        self.assertEqual(200, response.status_code)
+
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(3, len(rows))
+        self.assertEqual("company 1", rows[1]["razao_social"])
+        self.assertEqual("2001-02-02 01:01:01", rows[1]["data_atendimento_demanda"])
+
+    def test_export_csv_empty(self):
+        response = self.app.get(f"{self.EXPORT_ROUTE}?format=csv&ans=1234")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.text.splitlines()))
+
+    @unittest.skipIf(demandas_export.pyarrow is None, "pyarrow is not installed")
+    def test_export_arrow(self):
+        response = self.app.get(f"{self.EXPORT_ROUTE}?format=arrow")
+        self.assertEqual(200, response.status_code)
+
+        table = demandas_export.pyarrow.ipc.open_stream(response.data).read_all()
+        self.assertEqual([0, 1, 2], table.column("demanda_id").to_pylist())
+        self.assertEqual(self.mock_demandas[2].data_atendimento_demanda,
+                         table.column("data_atendimento_demanda")[2].as_py())
+
+    @unittest.skipIf(demandas_export.pyarrow is None, "pyarrow is not installed")
+    def test_export_parquet(self):
+        # small batches to write more than one row group.
+        stream_batch_size = demandas_export.STREAM_BATCH_SIZE
+        demandas_export.STREAM_BATCH_SIZE = 2
+        try:
+            response = self.app.get(f"{self.EXPORT_ROUTE}?format=parquet")
+        finally:
+            demandas_export.STREAM_BATCH_SIZE = stream_batch_size
+        self.assertEqual(200, response.status_code)
+
+        parquet_file = demandas_export.pyarrow.parquet.ParquetFile(io.BytesIO(response.data))
+        self.assertEqual(2, parquet_file.num_row_groups)
+        self.assertEqual(["company 0", "company 1", "company 2"],
+                         parquet_file.read().column("razao_social").to_pylist())
+
+    def test_export_invalid_format(self):
+        response = self.app.get(f"{self.EXPORT_ROUTE}?format=xml")
+        self.assertEqual(400, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
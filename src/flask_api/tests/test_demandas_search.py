@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from flask_api.tests.test_demandas import DemandasTestCase
+from flask_api.db.models.serializer import serialize
+
+
+class TestDemandasSearch(DemandasTestCase):
+    SEARCH_ROUTE = "/demandas/search"
+
+    def setUp(self):
+        super().setUp()
+        self.build_search_index()
+
+    def search_ids(self, query_string):
+        response = self.app.get(f"{self.SEARCH_ROUTE}?{query_string}")
+        self.assertEqual(200, response.status_code)
+        return [item["demanda_id"] for item in json.loads(response.data)["items"]]
+
+    def test_search(self):
+        response = self.app.get(f"{self.SEARCH_ROUTE}?q=company 1")
+        self.assertEqual(200, response.status_code)
+
+        result_json = json.loads(response.data)
+        self.assertEqual([serialize(self.mock_demandas[1])], result_json["items"])
+        self.assertIsNone(result_json["next_offset"])
+
+    def test_search_prefix_and_columns(self):
+        self.assertEqual([0, 1, 2], self.search_ids("q=comp"))
+        self.assertEqual([2], self.search_ids("q=subtema 2"))
+        # all words must match, in any of the columns.
+        self.assertEqual([1], self.search_ids("q=company subtema 1"))
+        self.assertEqual([], self.search_ids("q=company 3"))
+
+    def test_search_accents(self):
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "OPERADORA DE SAÚDE",
+                                                                "subtema_demanda": "Cobertura e Reembolso"})
+        self.assertEqual([3], self.search_ids("q=saude"))
+        self.assertEqual([3], self.search_ids("q=Saúde reembolso"))
+
+    def test_search_ranking(self):
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "saude",
+                                                                "subtema_demanda": "saude saude saude"})
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "operadora saude",
+                                                                "subtema_demanda": "reembolso"})
+        self.assertEqual([3, 4], self.search_ids("q=saude"))
+
+    def test_search_filter(self):
+        self.assertEqual([0, 2], self.search_ids("q=company&ans=0,4"))
+
+    def test_search_pagination(self):
+        response = self.app.get(f"{self.SEARCH_ROUTE}?q=company&limit=2")
+        result_json = json.loads(response.data)
+        self.assertEqual([0, 1], [item["demanda_id"] for item in result_json["items"]])
+        self.assertEqual(2, result_json["next_offset"])
+
+        self.assertEqual([2], self.search_ids("q=company&limit=2&offset=2"))
+
+    def test_search_sync_with_writes(self):
+        self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/0", data={"razao_social": "renamed"})
+        self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/1")
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/bulk/add",
+                      json=[{"ans": 1, "razao_social": "company 9"}, {"ans": 1, "razao_social": "other"}])
+
+        self.assertEqual([2, 3], sorted(self.search_ids("q=company")))
+        self.assertEqual([0], self.search_ids("q=renamed"))
+
+    def test_search_syntax_is_quoted(self):
+        self.assertEqual([], self.search_ids('q=company" OR "subtema'))
+        # without quoting 'NOT' would be an operator and return the demandas 0 and 2.
+        self.assertEqual([], self.search_ids("q=company NOT 1"))
+
+    def test_search_invalid(self):
+        self.assertEqual(400, self.app.get(f"{self.SEARCH_ROUTE}?q= ,;").status_code)
+        self.assertEqual(400, self.app.get(f"{self.SEARCH_ROUTE}?q=company&limit=0").status_code)
+        self.assertEqual(400, self.app.get(f"{self.SEARCH_ROUTE}?q=company&offset=-1").status_code)
+
+    def test_search_rebuild(self):
+        self.build_search_index()
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company 9"})
+        self.assertEqual([0, 1, 2, 3], sorted(self.search_ids("q=company")))
+
+    def test_search_not_built(self):
+        self.create_db()
+        self.assertEqual(503, self.app.get(f"{self.SEARCH_ROUTE}?q=company").status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
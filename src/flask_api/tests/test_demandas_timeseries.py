@@ -0,0 +1,119 @@
+import datetime
+import json
+import unittest
+from unittest.mock import patch
+
+from flask_api.cache import count_cache
+from flask_api.db.models import Demanda
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestDemandasTimeseries(DemandasTestCase):
+    TIMESERIES_ROUTE = "/demandas/count/timeseries"
+
+    def populate_db(self):
+        super().populate_db()
+        # company 1 also has demandas in march and april of 2001, and one demanda without date.
+        dates = [datetime.datetime(2001, 3, 5), datetime.datetime(2001, 3, 11, 23, 59), datetime.datetime(2001, 4, 30),
+                 None]
+        for i, date in enumerate(dates):
+            self.db_session.add(Demanda(demanda_id=10 + i, razao_social="company 1", ans=2,
+                                        data_atendimento_demanda=date, classificacao_demanda=f"classificacao {i % 2}"))
+        self.db_session.commit()
+
+    def get_timeseries(self, query_string):
+        response = self.app.get(f"{self.TIMESERIES_ROUTE}?{query_string}")
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.data)
+
+    def test_timeseries_month(self):
+        self.assertEqual([{"bucket": "2000-01", "total": 1}, {"bucket": "2001-02", "total": 1},
+                          {"bucket": "2001-03", "total": 2}, {"bucket": "2001-04", "total": 1},
+                          {"bucket": "2002-03", "total": 1}], self.get_timeseries("bucket=month"))
+
+    def test_timeseries_buckets(self):
+        self.assertEqual([{"bucket": "2000", "total": 1}, {"bucket": "2001", "total": 4},
+                          {"bucket": "2002", "total": 1}], self.get_timeseries("bucket=year"))
+        self.assertEqual(["2001-03-05", "2001-03-11"],
+                         [row["bucket"] for row in self.get_timeseries("bucket=day&from=2001-03-01&to=2001-03-31")])
+        # weeks start on monday, 2001-03-05 is a monday and 2001-03-11 the following sunday.
+        self.assertEqual([{"bucket": "2001-03-05", "total": 2}],
+                         self.get_timeseries("bucket=week&from=2001-03-01&to=2001-03-31"))
+
+    def test_timeseries_inclusive_range(self):
+        result = self.get_timeseries("bucket=day&from=2001-03-11&to=2001-04-30")
+        self.assertEqual([{"bucket": "2001-03-11", "total": 1}, {"bucket": "2001-04-30", "total": 1}], result)
+
+    def test_timeseries_group_by_and_filter(self):
+        result = self.get_timeseries("bucket=month&from=2001-01-01&to=2001-12-31&razao_social=company%201"
+                                     "&group_by=classificacao_demanda")
+        self.assertEqual([
+            {"bucket": "2001-02", "classificacao_demanda": "classificacao 1", "total": 1},
+            {"bucket": "2001-03", "classificacao_demanda": "classificacao 0", "total": 1},
+            {"bucket": "2001-03", "classificacao_demanda": "classificacao 1", "total": 1},
+            {"bucket": "2001-04", "classificacao_demanda": "classificacao 0", "total": 1},
+        ], result)
+
+    def test_timeseries_cache(self):
+        route = f"{self.TIMESERIES_ROUTE}?bucket=year&from=2001-01-01"
+        self.assertEqual("MISS", self.app.get(route).headers["X-Cache"])
+        self.assertEqual("HIT", self.app.get(route).headers["X-Cache"])
+        self.assertEqual("MISS", self.app.get(f"{self.TIMESERIES_ROUTE}?bucket=month&from=2001-01-01")
+                         .headers["X-Cache"])
+
+        self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/10")
+        response = self.app.get(route)
+        self.assertEqual("MISS", response.headers["X-Cache"])
+        self.assertEqual([{"bucket": "2001", "total": 3}, {"bucket": "2002", "total": 1}], json.loads(response.data))
+
+    def test_timeseries_invalid(self):
+        self.assertEqual(400, self.app.get(f"{self.TIMESERIES_ROUTE}?bucket=hour").status_code)
+        self.assertEqual(400, self.app.get(f"{self.TIMESERIES_ROUTE}?from=2001-13-01").status_code)
+        self.assertEqual(400, self.app.get(f"{self.TIMESERIES_ROUTE}?from=2002-01-01&to=2001-01-01").status_code)
+
+    def test_timeseries_uses_range_index(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/timeseries?from=2001-01-01&to=2001-12-31")
+        result_json = json.loads(response.data)
+        self.assertEqual([], result_json["full_scans"])
+        self.assertTrue(any("ix_demandas_data_atendimento_demanda" in step and "data_atendimento_demanda>" in step
+                            for step in result_json["plan"]), result_json["plan"])
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/timeseries?from=2001-01-01&to=2001-12-31"
+                                f"&razao_social=company%201")
+        plan = json.loads(response.data)["plan"]
+        self.assertTrue(any("ix_demandas_razao_social_data_atendimento_demanda" in step for step in plan), plan)
+
+    def explain_uses_month_rollup(self, query_string):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/explain/timeseries?{query_string}")
+        return "Demandas_rollup_mes" in json.loads(response.data)["query"]
+
+    def test_timeseries_month_rollup(self):
+        query_strings = ["bucket=month", "bucket=month&from=2001-03-01&to=2001-04-30", "bucket=month&to=2001-02-28",
+                         "bucket=month&from=2001-03-06", "bucket=month&razao_social=company%201",
+                         "bucket=month&group_by=classificacao_demanda", "bucket=year"]
+        # the writes keep the rollup up to date.
+        self.build_rollups()
+        self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/10")
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company 0",
+                                                               "data_atendimento_demanda": "2001-04-02 10:00:00"})
+
+        for query_string in query_strings:
+            with self.subTest(query_string=query_string):
+                count_cache.clear()
+                with patch("flask_api.routes.demandas.find_timeseries_rollup", return_value=None):
+                    expected = self.get_timeseries(query_string)
+                count_cache.clear()
+                self.assertEqual(expected, self.get_timeseries(query_string))
+        self.assertEqual({"bucket": "2001-04", "total": 2}, self.get_timeseries("bucket=month")[3])
+        # only the monthly timeseries of whole months, not grouped nor filtered, are read from the rollup.
+        self.assertEqual([True, True, True, False, False, False, False],
+                         [self.explain_uses_month_rollup(query_string) for query_string in query_strings])
+
+    def test_month_is_not_a_count_column(self):
+        self.build_rollups()
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=mes")
+        self.assertEqual(400, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
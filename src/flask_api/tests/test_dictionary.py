@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from sqlalchemy import text
+
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestDictionaryEncoding(DemandasTestCase):
+    def query(self, sql):
+        with self.engine.connect() as connection:
+            return connection.execute(text(sql)).all()
+
+    def test_stored_as_codes(self):
+        self.assertEqual([("integer", 3)], self.query("SELECT typeof(razao_social), count(*) FROM Demandas GROUP BY 1"))
+        self.assertEqual([(1, "company 0"), (2, "company 1"), (3, "company 2")],
+                         self.query("SELECT code, value FROM Demandas_razao_social ORDER BY code"))
+
+    def test_values_are_shared(self):
+        self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company 0"})
+        self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/1", data={"razao_social": "company 9"})
+        self.assertEqual([("company 0", 2), ("company 2", 1), ("company 9", 1)],
+                         self.query("SELECT value, count(*) FROM Demandas JOIN Demandas_razao_social "
+                                    "ON code = razao_social GROUP BY value ORDER BY value"))
+
+    def test_filter_and_group_return_strings(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=razao_social"
+                                f"&natureza_demanda=natureza%200,natureza%202,unknown")
+        self.assertEqual([{"razao_social": "company 0", "total": 1}, {"razao_social": "company 2", "total": 1}],
+                         json.loads(response.data))
+
+    def test_unknown_filter_value(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?razao_social=unknown")
+        self.assertEqual([], json.loads(response.data))
+        # reads don't add values to the lookup table.
+        self.assertEqual([(3,)], self.query("SELECT count(*) FROM Demandas_razao_social"))
+
+    def test_bulk_add_new_values(self):
+        response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/bulk/add",
+                                 json=[{"ans": 1, "razao_social": "company 7", "subtema_demanda": "subtema 7"},
+                                       {"ans": 1, "razao_social": "company 8", "subtema_demanda": "subtema 7"}])
+        self.assertEqual(200, response.status_code)
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?subtema_demanda=subtema%207")
+        self.assertEqual(["company 7", "company 8"], [item["razao_social"] for item in json.loads(response.data)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import threading
+import unittest
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from flask_api.app import app
+from flask_api.db import database
+from flask_api.db.database import Base
+from flask_api.db.group_commit import writer
+from flask_api.db.models import Demanda
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestGroupCommit(DemandasTestCase):
+    def create_db(self):
+        # the writer thread must see the same in memory database.
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        self.db_session = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        Base.query = self.db_session.query_property()
+        database.engine = self.engine
+        database.session = self.db_session
+        database.read_session = self.db_session
+
+        self.commits = 0
+
+        @event.listens_for(self.engine, "commit")
+        def count_commit(connection):
+            self.commits += 1
+
+    def setUp(self):
+        super().setUp()
+        writer.enabled = True
+        self.commits = 0
+
+    def tearDown(self):
+        writer.enabled = False
+        writer.max_delay_ms = 2
+
+    def count_rows(self):
+        return self.db_session.execute(select(func.count(Demanda.demanda_id))).scalar()
+
+    def test_concurrent_adds_share_commits(self):
+        writer.max_delay_ms = 100
+        responses = []
+
+        def add(i):
+            response = app.test_client().post(f"{self.DEMANDAS_BASE_ROUTE}/add",
+                                              data={"ans": 100 + i, "razao_social": f"company {i}"})
+            responses.append(response.status_code)
+
+        threads = [threading.Thread(target=add, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([201] * 10, responses)
+        self.assertEqual(13, self.count_rows())
+        self.assertLess(self.commits, 10)
+
+    def test_update_and_delete(self):
+        response = self.app.put(f"{self.DEMANDAS_BASE_ROUTE}/update/1", data={"ans": 99})
+        self.assertEqual(200, response.status_code)
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/2")
+        self.assertEqual(200, response.status_code)
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/2")
+        self.assertEqual(404, response.status_code)
+
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=demanda_id,ans")
+        self.assertEqual([{"demanda_id": 0, "ans": 0}, {"demanda_id": 1, "ans": 99}], json.loads(response.data))
+
+    def test_failed_operation_doesnt_fail_batch(self):
+        writer.max_delay_ms = 100
+
+        def fail(session):
+            raise ValueError("failed")
+
+        def add(session):
+            session.add(Demanda(ans=1, razao_social="company 5"))
+            return "added"
+
+        results = {}
+
+        def submit(name, operation):
+            try:
+                results[name] = writer.submit(operation)
+            except ValueError as e:
+                results[name] = e
+
+        threads = [threading.Thread(target=submit, args=("fail", fail)),
+                   threading.Thread(target=submit, args=("add", add))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(results["fail"], ValueError)
+        self.assertEqual("added", results["add"])
+        self.assertEqual(4, self.count_rows())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import re
+import unittest
+from unittest import mock
+
+from flask_api import metrics
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestMetrics(DemandasTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.metrics.clear()
+
+    def server_timing(self, response):
+        return {name: float(duration) for name, duration in re.findall(r"(\w+);dur=([\d.]+)",
+                                                                         response.headers["Server-Timing"])}
+
+    def test_server_timing_header(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?limit=2")
+        self.assertEqual(200, response.status_code)
+        self.assertIn('desc="1 queries"', response.headers["Server-Timing"])
+
+        timings = self.server_timing(response)
+        self.assertEqual({"sql", "serialize", "total"}, set(timings))
+        self.assertGreater(timings["sql"], 0)
+        self.assertGreater(timings["serialize"], 0)
+        self.assertLessEqual(timings["sql"] + timings["serialize"], timings["total"])
+
+    def test_server_timing_cached_count(self):
+        self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertEqual("HIT", response.headers["X-Cache"])
+        self.assertIn('desc="0 queries"', response.headers["Server-Timing"])
+
+    def test_metrics_histograms(self):
+        for _ in range(3):
+            self.app.get(f"{self.DEMANDAS_BASE_ROUTE}")
+        self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+
+        response = self.app.get("/metrics")
+        self.assertEqual(200, response.status_code)
+        result = response.json
+        self.assertEqual({"demandas.demandas", "demandas.demandas_count"}, set(result))
+
+        total = result["demandas.demandas"]["total_ms"]
+        self.assertEqual(3, total["count"])
+        self.assertEqual(3, total["buckets"]["+Inf"])
+        self.assertEqual(3, result["demandas.demandas"]["queries"]["sum"])
+
+    def test_slow_query_log(self):
+        with mock.patch.object(metrics, "SLOW_QUERY_MS", 0), self.assertLogs(metrics.logger, "WARNING") as logs:
+            self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+        self.assertIn("Slow query", logs.output[0])
+
+    def test_no_slow_query_log(self):
+        with mock.patch.object(metrics, "SLOW_QUERY_MS", 60000), self.assertNoLogs(metrics.logger, "WARNING"):
+            self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+from flask_api.db.database import QueryTimeout, set_query_timeout
+from flask_api.routes.demandas import create_count_query, create_demandas_query
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestQueryGuard(DemandasTestCase):
+    def test_unknown_filter_column(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?something=1")
+        self.assertEqual(400, response.status_code)
+        self.assertIn(b"unknown column 'something'", response.data)
+
+    def test_unknown_group_column(self):
+        # model attributes that are not columns can't be used either.
+        for route in ("count", "count/timeseries"):
+            response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/{route}?group_by=query")
+            self.assertEqual(400, response.status_code)
+
+    def test_row_limit(self):
+        with patch("flask_api.utils.MAX_QUERY_ROWS", 2):
+            self.assertEqual(400, self.app.get(self.DEMANDAS_BASE_ROUTE).status_code)
+            self.assertEqual(400, self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans").status_code)
+
+            response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?ans=0,2")
+            self.assertEqual(2, len(json.loads(response.data)))
+            # pages and streams are not limited.
+            response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?stream=true")
+            self.assertEqual(3, len(json.loads(response.data)))
+
+    def test_statement_shape(self):
+        # the compiled statement is cached by the filtered columns, not by the filter values.
+        key = create_count_query(["ans"], args={"razao_social": "company 0"})._generate_cache_key()
+        self.assertEqual(key, create_count_query(["ans"], args={"razao_social": "a,b,c"})._generate_cache_key())
+        self.assertNotEqual(key, create_count_query(["ans"], args={"ans": "1"})._generate_cache_key())
+        self.assertEqual(create_demandas_query(args={"ans": "1"})._generate_cache_key(),
+                         create_demandas_query(args={"ans": "1,2"})._generate_cache_key())
+
+    def test_query_timeout(self):
+        engine = create_engine("sqlite://")
+        set_query_timeout(engine, 10)
+        endless = text("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c")
+        with engine.connect() as connection:
+            with self.assertRaises(QueryTimeout):
+                connection.execute(endless)
+            # the connection can still be used.
+            self.assertEqual(1, connection.execute(text("SELECT 1")).scalar())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+from flask_api.db import database
+from flask_api.db.database import Base
+from flask_api.db.models import Demanda
+from flask_api.db.snapshot import publish_snapshot, snapshot
+from flask_api.tests.test_demandas import DemandasTestCase
+
+
+class TestSnapshot(DemandasTestCase):
+    def create_db(self):
+        # the loader database, the api serves the snapshots published from it.
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'db.sqlite')}")
+        self.db_session = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        Base.query = self.db_session.query_property()
+        database.engine = self.engine
+        database.session = self.db_session
+        database.read_session = self.db_session
+
+    def setUp(self):
+        super().setUp()
+        self.db_session.remove()
+        self.snapshot_path = os.path.join(self.directory.name, "snapshot.sqlite")
+        publish_snapshot(self.engine, self.snapshot_path)
+        snapshot.path = self.snapshot_path
+        snapshot.check_seconds = 0
+        snapshot.open()
+
+    def tearDown(self):
+        database.engine.dispose()
+        self.engine.dispose()
+        snapshot.path = None
+        snapshot.file_id = None
+        self.directory.cleanup()
+
+    def get_ids(self):
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}?fields=demanda_id")
+        self.assertEqual(200, response.status_code)
+        return [row["demanda_id"] for row in json.loads(response.data)]
+
+    def test_serves_snapshot(self):
+        self.assertEqual([0, 1, 2], self.get_ids())
+        response = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count?group_by=ans")
+        self.assertEqual(3, len(json.loads(response.data)))
+
+    def test_refuses_writes(self):
+        response = self.app.post(f"{self.DEMANDAS_BASE_ROUTE}/add", data={"ans": 1, "razao_social": "company"})
+        self.assertEqual(405, response.status_code)
+        response = self.app.delete(f"{self.DEMANDAS_BASE_ROUTE}/delete/1")
+        self.assertEqual(405, response.status_code)
+        self.assertEqual([0, 1, 2], self.get_ids())
+
+    def test_new_snapshot_is_served(self):
+        count = self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count").data
+        previous_engine = database.engine
+
+        with Session(self.engine) as session:
+            session.add(Demanda(demanda_id=3, ans=3, razao_social="company 3"))
+            session.commit()
+        # the published snapshot doesn't change until a new one replaces it.
+        self.assertEqual([0, 1, 2], self.get_ids())
+        publish_snapshot(self.engine, self.snapshot_path)
+
+        self.assertEqual([0, 1, 2, 3], self.get_ids())
+        self.assertIsNot(previous_engine, database.engine)
+        self.assertNotEqual(count, self.app.get(f"{self.DEMANDAS_BASE_ROUTE}/count").data)
+
+    def test_published_file(self):
+        with closing(sqlite3.connect(self.snapshot_path)) as connection:
+            self.assertEqual("delete", connection.execute("PRAGMA journal_mode").fetchone()[0])
+            # the statistics of ANALYZE are copied to the snapshot.
+            self.assertGreater(connection.execute("SELECT count(*) FROM sqlite_stat1").fetchone()[0], 0)
+        self.assertFalse(os.path.exists(f"{self.snapshot_path}.tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
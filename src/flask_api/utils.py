@@ -1,18 +1,128 @@
+from datetime import datetime, timedelta
+
 from flask import request
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from settings import MAX_QUERY_ROWS
+
+# Query arguments that control the routes and must not be used as column filters.
+RESERVED_ARGS = {"group_by", "after", "limit", "offset", "stream", "format", "q", "bucket", "from", "to",
+                 "fields"}
+
+
+class InvalidQuery(ValueError):
+    """ A query the routes refuse to run, returned as a 400 response by the app error handler. """
+
+
+def get_column(source, column: str):
+    """
+    Returns the column named 'column' of 'source', a model or the columns of a table. Raises InvalidQuery if it's not
+    one of its columns, so only real columns can be filtered or grouped.
+    """
+    columns = source.__table__.columns if hasattr(source, "__table__") else source
+    if column not in columns.keys():
+        raise InvalidQuery(f"unknown column '{column}'")
+    return getattr(source, column)
+
 
+def limit_rows(query):
+    """ Limit 'query' to one row more than MAX_QUERY_ROWS, so 'check_row_limit' can tell if the result is too big. """
+    return query.limit(MAX_QUERY_ROWS + 1)
 
-def create_filtered_query(query, model):
-    for column, values in request.args.items():
-        if column == 'group_by':
+
+def check_row_limit(rows):
+    """ Raises InvalidQuery if 'rows' has more than MAX_QUERY_ROWS rows. """
+    if len(rows) > MAX_QUERY_ROWS:
+        raise InvalidQuery(f"the result has more than {MAX_QUERY_ROWS} rows")
+    return rows
+
+
+# The functions below read the flask request arguments unless other 'args' are given.
+
+
+def create_filtered_query(query, model, args=None):
+    args = request.args if args is None else args
+    for column, values in args.items():
+        if column in RESERVED_ARGS:
             continue
+        query = query.filter(get_column(model, column).in_(values.split(',')))
+    return query
+
+
+def get_filter_columns(args=None):
+    """ Returns the names of the columns filtered in the request. """
+    args = request.args if args is None else args
+    return [column for column in args.keys() if column not in RESERVED_ARGS]
 
-        column_obj = getattr(model, column)
-        if column_obj is not None:
-            query = query.filter(column_obj.in_(values.split(',')))
+
+def get_group_columns(args=None):
+    """ Returns the names of the columns in '?group_by='. """
+    args = request.args if args is None else args
+    group_by = args.get("group_by")
+    return group_by.split(',') if group_by else []
+
+
+class ExplainQueryPlan(Executable, ClauseElement):
+    """ 'EXPLAIN QUERY PLAN' of a select, compiled with the bound parameters of the select. """
+    inherit_cache = False
+
+    def __init__(self, query):
+        self.query = query
+
+
+@compiles(ExplainQueryPlan)
+def compile_explain_query_plan(element, compiler, **kw):
+    return f"EXPLAIN QUERY PLAN {compiler.process(element.query, **kw)}"
+
+
+def explain_query_plan(session, query):
+    """
+    Returns the sqlite query plan of 'query' and the steps that read the whole table, which are all the 'SCAN' steps:
+    a scan using an index reads every entry of the index, it only avoids sorting (or, covering, reading the rows).
+    """
+    # the values are only written in the returned query, the plan is of the query with its bound parameters.
+    sql = str(query.compile(dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    plan = [row.detail for row in session.execute(ExplainQueryPlan(query))]
+    # the scans of virtual tables are lookups of their own index, like the MATCH of the search table.
+    full_scans = [step for step in plan if step.startswith("SCAN ") and " VIRTUAL TABLE " not in step]
+    return {"query": sql, "plan": plan, "full_scans": full_scans}
+
+
+def parse_date_range(args=None):
+    """
+    Returns the inclusive '?from=YYYY-MM-DD&to=YYYY-MM-DD' dates as the start and the exclusive end datetimes, which are
+    None when not given. Raises ValueError if a date is invalid.
+    """
+    args = request.args if args is None else args
+    start = args.get("from")
+    end = args.get("to")
+    start = datetime.strptime(start, "%Y-%m-%d") if start else None
+    # the whole 'to' day is included.
+    end = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end else None
+    if start is not None and end is not None and start >= end:
+        raise ValueError("from must not be after to")
+    return start, end
+
+
+def create_date_range_query(query, column_obj, start, end):
+    """ Filter 'query' to the rows where 'column_obj' is in [start, end), an index on the column can seek the range. """
+    if start is not None:
+        query = query.where(column_obj >= start)
+    if end is not None:
+        query = query.where(column_obj < end)
     return query
 
 
 def create_group_by_query(query, columns):
     for column_obj in columns:
         query = query.group_by(column_obj)
-    return query
\ No newline at end of file
+    return query
+
+
+def create_query_key(args=None):
+    """ Returns a hashable key of the request filters and group_by, equivalent queries have the same key. """
+    args = request.args if args is None else args
+    filters = tuple(sorted((column, tuple(sorted(values.split(','))))
+                           for column, values in args.items() if column not in RESERVED_ARGS))
+    return filters, tuple(get_group_columns(args))
@@ -1,4 +1,72 @@
 import os
 
 DATABASE_FILE_NAME = "db.sqlite"
-DATABASE_PATH = f"sqlite:///{os.path.dirname(os.path.abspath(__file__))}/{DATABASE_FILE_NAME}"
\ No newline at end of file
+DATABASE_PATH = os.environ.get("DATABASE_PATH",
+                               f"sqlite:///{os.path.dirname(os.path.abspath(__file__))}/{DATABASE_FILE_NAME}")
+
+# Pagination and streaming of the /demandas route.
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 10000
+STREAM_BATCH_SIZE = 1000
+
+# Maximum number of different queries kept in the /demandas/count cache.
+COUNT_CACHE_SIZE = 256
+
+# Guards of the dynamic queries: the most rows a non paginated result can have (larger results are refused, use the
+# pagination or the streaming) and the most time a statement can run before sqlite interrupts it (0 disables it).
+MAX_QUERY_ROWS = int(os.environ.get("MAX_QUERY_ROWS", 100000))
+QUERY_TIMEOUT_MS = float(os.environ.get("QUERY_TIMEOUT_MS", 5000))
+# Compiled statements kept by each engine. Statements are cached by their shape: the filtered and grouped columns,
+# not the filter values (the lists of an 'IN' are expanded when the statement runs).
+STATEMENT_CACHE_SIZE = 1000
+
+# Answer /demandas/count from an in memory numpy copy of the grouped and filtered columns (see db/column_store.py).
+COLUMN_STORE = os.environ.get("COLUMN_STORE", "false").lower() == "true"
+
+# Group commit of the /demandas/add, update and delete routes (see db/group_commit.py): a single writer thread commits
+# the writes together, at most GROUP_COMMIT_MAX_DELAY_MS after the first write of a batch or every
+# GROUP_COMMIT_MAX_OPERATIONS writes.
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_MAX_DELAY_MS = float(os.environ.get("GROUP_COMMIT_MAX_DELAY_MS", 2))
+GROUP_COMMIT_MAX_OPERATIONS = int(os.environ.get("GROUP_COMMIT_MAX_OPERATIONS", 64))
+
+# Read only snapshot mode (see db/snapshot.py): when SNAPSHOT_PATH is set the API serves the immutable database file
+# published there by the data loader ("--publish-snapshot"), refuses the write routes and checks every
+# SNAPSHOT_CHECK_SECONDS if a new snapshot was published. The snapshot is memory mapped up to SNAPSHOT_MMAP_SIZE bytes,
+# off by default: a new worker reading a snapshot that isn't in the page cache starts faster with read() (see README).
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH")
+SNAPSHOT_MMAP_SIZE = int(os.environ.get("SNAPSHOT_MMAP_SIZE", 0))
+SNAPSHOT_CHECK_SECONDS = float(os.environ.get("SNAPSHOT_CHECK_SECONDS", 1))
+
+# Queries slower than this are logged, and the bounds of the latency histograms of the /metrics route.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+METRICS_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Same database used by the asgi app, through the async sqlite driver.
+ASYNC_DATABASE_PATH = DATABASE_PATH.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+# Engine profiles: pragmas set on every connection, connection pool size and whether reads use a separate read only
+# pool. The profile is selected with the DATABASE_PROFILE environment variable.
+DATABASE_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "pool_size": 5,
+        "max_overflow": 10,
+        "read_only_pool": False,
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -65536,  # 64MB
+            "mmap_size": 268435456,  # 256MB
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+        # enough connections for every thread of a threaded worker.
+        "pool_size": 16,
+        "max_overflow": 16,
+        "read_only_pool": True,
+    },
+}
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "default")